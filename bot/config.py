@@ -62,6 +62,21 @@ VOICE_SYSTEM_PROMPT = os.getenv("VOICE_SYSTEM_PROMPT", "Ты голосовой
 # Путь к файлу профиля пользователя
 USER_PROFILE_PATH = PROJECT_ROOT / "config" / "user_profile.json"
 
+# Файл персистентности user_data/chat_data (переживает перезапуск бота)
+# Пустое значение BOT_PERSISTENCE_PATH отключает персистентность
+BOT_PERSISTENCE_PATH = os.getenv("BOT_PERSISTENCE_PATH", str(PROJECT_ROOT / "bot" / "bot_persistence.pickle")).strip()
+
+# Сохранять ли Markdown-файлы /digest на диск (bot/digests). Пользователю файл уходит из памяти в любом случае
+DIGEST_SAVE_FILES = os.getenv("DIGEST_SAVE_FILES", "1").strip().lower() not in ("0", "false", "no", "")
+
+# Webhook вместо long polling: включается, если задан публичный WEBHOOK_URL (https://host).
+# Нужен python-telegram-bot[webhooks] (tornado). Пустой URL — обычный polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "").strip().strip("/")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "").strip()
+
 # Альтернативные модели
 MODEL_GLM = (os.getenv("OPENROUTER_MODEL_GLM") or "").strip()
 MODEL_GEMMA = (os.getenv("OPENROUTER_MODEL_GEMMA") or "").strip()
@@ -13,6 +13,7 @@ from typing import Any
 import requests
 
 from .config import OPENROUTER_API_KEY, EMBEDDING_MODEL
+from .openrouter import HTTP_SESSION
 
 logger = logging.getLogger(__name__)
 
@@ -211,7 +212,7 @@ def generate_embeddings_batch(texts: list[str], model: str = EMBEDDING_MODEL) ->
     logger.info(f"Requesting embeddings from model: {model}, texts count: {len(texts)}")
     
     try:
-        response = requests.post(OPENROUTER_EMBEDDINGS_URL, headers=headers, json=payload, timeout=120)
+        response = HTTP_SESSION.post(OPENROUTER_EMBEDDINGS_URL, headers=headers, json=payload, timeout=120)
         
         # Логируем статус и ответ для отладки
         logger.info(f"Embeddings API response status: {response.status_code}")
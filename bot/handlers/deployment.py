@@ -10,7 +10,7 @@ from ..core.errors import safe_reply_text
 from ..handlers.base import Handler
 from ..mcp_client import (
     deploy_check_docker, deploy_upload_image, deploy_load_image,
-    deploy_create_compose, deploy_create_env, deploy_start_bot,
+    deploy_prepare_files, deploy_start_bot,
     deploy_check_container, deploy_stop_bot
 )
 from ..config import (
@@ -129,21 +129,6 @@ class DeployBotHandler(Handler):
       - ./digests:/app/bot/digests
     user: "0:0"
 """
-            await safe_reply_text(update, "📝 Создаю docker-compose.yml...")
-            compose_result = await deploy_create_compose(
-                deploy_ssh_host, deploy_ssh_port, deploy_ssh_username, deploy_ssh_password,
-                compose_content, compose_path
-            )
-            if not compose_result or compose_result.get("status") != "success":
-                error_msg = compose_result.get("message", "Неизвестная ошибка") if compose_result else "Ошибка при создании docker-compose.yml"
-                await safe_reply_text(update, f"❌ Ошибка при создании docker-compose.yml: {error_msg}")
-                return
-            compose_msg = compose_result.get('message', 'docker-compose.yml создан')
-            if compose_result.get('skipped'):
-                await safe_reply_text(update, f"⏭️ {compose_msg}")
-            else:
-                await safe_reply_text(update, f"✅ {compose_msg}")
-            
             env_path = f"{deploy_remote_path}/.env"
             env_content = f"""TELEGRAM_BOT_TOKEN={deploy_bot_token}
 OPENROUTER_API_KEY={deploy_openrouter_api_key}
@@ -159,11 +144,22 @@ OLLAMA_NUM_CTX={deploy_ollama_num_ctx}
 OLLAMA_NUM_PREDICT={deploy_ollama_num_predict}
 OLLAMA_SYSTEM_PROMPT={deploy_ollama_system_prompt}
 """
-            await safe_reply_text(update, "📝 Проверяю .env файл...")
-            env_result = await deploy_create_env(
+            await safe_reply_text(update, "📝 Создаю docker-compose.yml и проверяю .env файл...")
+            # Файлы независимы — создаём их параллельно
+            compose_result, env_result = await deploy_prepare_files(
                 deploy_ssh_host, deploy_ssh_port, deploy_ssh_username, deploy_ssh_password,
-                env_content, env_path
+                compose_content, env_content, compose_path, env_path
             )
+            if not compose_result or compose_result.get("status") != "success":
+                error_msg = compose_result.get("message", "Неизвестная ошибка") if compose_result else "Ошибка при создании docker-compose.yml"
+                await safe_reply_text(update, f"❌ Ошибка при создании docker-compose.yml: {error_msg}")
+                return
+            compose_msg = compose_result.get('message', 'docker-compose.yml создан')
+            if compose_result.get('skipped'):
+                await safe_reply_text(update, f"⏭️ {compose_msg}")
+            else:
+                await safe_reply_text(update, f"✅ {compose_msg}")
+            
             if not env_result or env_result.get("status") != "success":
                 error_msg = env_result.get("message", "Неизвестная ошибка") if env_result else "Ошибка при создании .env файла"
                 await safe_reply_text(update, f"❌ Ошибка при создании .env файла: {error_msg}")
@@ -1,5 +1,7 @@
 """Help command handler."""
 
+import asyncio
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
@@ -7,7 +9,7 @@ from ..core.errors import safe_reply_text
 from ..handlers.base import Handler
 from ..services.context_manager import get_temperature, get_memory_enabled, get_model
 from ..services.memory import add_message
-from ..services.database import db_add_message
+from ..services.database import db_add_messages_batch
 from ..services.llm import call_llm
 from ..config import OPENROUTER_MODEL, RAG_SIM_THRESHOLD, RAG_TOP_K, EMBEDDING_MODEL
 from ..embeddings import search_relevant_chunks, has_embeddings, list_indexed_documents
@@ -240,8 +242,9 @@ class HelpHandler(Handler):
         
         # Save to DB
         mode = "text"
-        db_add_message(chat_id, mode, "user", f"/help {question_text}")
-        db_add_message(chat_id, mode, "assistant", answer)
+        await asyncio.to_thread(
+            db_add_messages_batch, chat_id, mode, [("user", f"/help {question_text}"), ("assistant", answer)]
+        )
         
         await safe_reply_text(update, answer)
 
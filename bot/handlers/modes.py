@@ -7,7 +7,8 @@ from telegram.ext import ContextTypes
 from ..core.errors import safe_reply_text
 from ..core.context import AgentContext
 from ..handlers.base import Handler
-from ..services.database import db_set_model, db_set_memory_enabled, utc_now_iso
+from ..services.database import db_set_model, db_set_memory_enabled
+from ..utils.helpers import utc_now_iso
 from ..services.context_manager import get_effective_model
 from ..config import OPENROUTER_MODEL
 from ..summarizer import MODE_SUMMARY
@@ -5,7 +5,7 @@ from telegram.ext import ContextTypes
 
 from ..core.errors import safe_reply_text
 from ..handlers.base import Handler
-from ..mcp_client import user_register, user_delete, reg_create, reg_find_by_user, reg_reschedule, reg_cancel, user_get
+from ..mcp_client import user_register, user_delete, reg_create, reg_find_by_user, reg_reschedule, reg_cancel, fetch_user_context
 from ..embeddings import search_relevant_chunks, has_embeddings
 from ..services.context_manager import get_temperature, get_model
 from ..services.llm import call_llm
@@ -219,17 +219,7 @@ class SupportHandler(Handler):
         await update.message.chat.send_action("typing")
         
         try:
-            user_data = None
-            try:
-                user_data = await user_get(username)
-            except ValueError as e:
-                logger.warning(f"Could not get user data: {e}")
-            
-            active_regs = []
-            try:
-                active_regs = await reg_find_by_user(username) or []
-            except ValueError as e:
-                logger.warning(f"Could not get user registrations: {e}")
+            user_data, active_regs = await fetch_user_context(username)
             
             context_parts = []
             if user_data:
@@ -6,7 +6,7 @@ from telegram.ext import ContextTypes
 
 from ..core.errors import safe_reply_text
 from ..handlers.base import Handler
-from ..mcp_client import get_pr_info, get_pr_files, get_pr_diff
+from ..mcp_client import get_pr_bundle
 from ..services.llm import call_llm
 from ..config import OPENROUTER_MODEL
 from ..config import PR_REVIEW_AVAILABLE
@@ -65,7 +65,8 @@ class ReviewPrHandler(Handler):
         try:
             await safe_reply_text(update, f"📥 Получаю данные PR #{pr_number}...")
             try:
-                pr_info = await get_pr_info(owner, repo, pr_number, github_token)
+                # info, files и diff запрашиваются параллельно
+                pr_bundle = await get_pr_bundle(owner, repo, pr_number, github_token)
             except ValueError as e:
                 error_msg = str(e)
                 if "404" in error_msg or "не найден" in error_msg.lower():
@@ -73,22 +74,9 @@ class ReviewPrHandler(Handler):
                 elif "401" in error_msg or "Unauthorized" in error_msg:
                     await safe_reply_text(update, f"❌ Ошибка авторизации GitHub.\nПроверьте правильность GB_TOKEN в .env файле.")
                 else:
-                    await safe_reply_text(update, f"❌ Ошибка при получении информации о PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен (http://127.0.0.1:8000/mcp)\n2. Правильность GB_TOKEN")
-                return
-            
-            try:
-                pr_files = await get_pr_files(owner, repo, pr_number, github_token)
-            except ValueError as e:
-                error_msg = str(e)
-                await safe_reply_text(update, f"❌ Ошибка при получении файлов PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен\n2. Правильность GB_TOKEN\n3. Доступ к репозиторию")
-                return
-            
-            try:
-                pr_diff = await get_pr_diff(owner, repo, pr_number, github_token)
-            except ValueError as e:
-                error_msg = str(e)
-                await safe_reply_text(update, f"❌ Ошибка при получении diff PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен\n2. Правильность GB_TOKEN")
+                    await safe_reply_text(update, f"❌ Ошибка при получении данных PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен (http://127.0.0.1:8000/mcp)\n2. Правильность GB_TOKEN\n3. Доступ к репозиторию")
                 return
+            pr_info, pr_files, pr_diff = pr_bundle["info"], pr_bundle["files"], pr_bundle["diff"]
             
             pr_title = pr_info.get("title", "N/A")
             await safe_reply_text(update, f"✅ Получены данные PR: {pr_title}\n📁 Файлов изменено: {len(pr_files)}\n🔍 Ищу релевантную документацию...")
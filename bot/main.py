@@ -3,20 +3,34 @@
 import os
 import json
 import re
+import asyncio
 import sqlite3
+import atexit
+import threading
 import logging
 import requests
 import base64
-from datetime import datetime, timezone
+import secrets
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from contextlib import contextmanager
+from functools import lru_cache
+from types import MappingProxyType
+
+try:
+    import orjson  # необязательно: если установлен, JSON-ответы сериализуются/парсятся в C
+except ImportError:
+    orjson = None
 
 from telegram import Update, BotCommand
-from telegram.error import TimedOut, BadRequest
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.error import TimedOut, BadRequest, RetryAfter
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, ContextTypes, PicklePersistence, PersistenceInput, filters
 from telegram.request import HTTPXRequest
 
-from .config import TELEGRAM_BOT_TOKEN, OPENROUTER_API_KEY, OPENROUTER_MODEL, RAG_SIM_THRESHOLD, RAG_TOP_K, EMBEDDING_MODEL, OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT, OLLAMA_TEMPERATURE, OLLAMA_NUM_CTX, OLLAMA_NUM_PREDICT, OLLAMA_SYSTEM_PROMPT, ANALYZE_MODEL, ME_MODEL, USER_PROFILE_PATH, VOICE_MODEL, VOICE_SYSTEM_PROMPT, MODEL_GLM, MODEL_GEMMA, PR_REVIEW_AVAILABLE
-from .openrouter import chat_completion, chat_completion_raw, transcribe_audio
+from .config import TELEGRAM_BOT_TOKEN, OPENROUTER_API_KEY, OPENROUTER_MODEL, RAG_SIM_THRESHOLD, RAG_TOP_K, EMBEDDING_MODEL, OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT, OLLAMA_TEMPERATURE, OLLAMA_NUM_CTX, OLLAMA_NUM_PREDICT, OLLAMA_SYSTEM_PROMPT, ANALYZE_MODEL, ME_MODEL, USER_PROFILE_PATH, VOICE_MODEL, VOICE_SYSTEM_PROMPT, MODEL_GLM, MODEL_GEMMA, PR_REVIEW_AVAILABLE, BOT_PERSISTENCE_PATH, DIGEST_SAVE_FILES, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN
+from .openrouter import chat_completion, chat_completion_cached, chat_completion_raw_async, chat_completion_stream, transcribe_audio, close_http_session, close_async_client
 
 # NEW: God Agent architecture imports
 from .core.errors import safe_reply_text, handle_error
@@ -25,7 +39,9 @@ from .services.database import init_db, db_set_temperature, db_set_memory_enable
 from .services.context_manager import get_mode, get_temperature, get_memory_enabled, get_model, get_effective_model
 from .services.memory import add_message, get_messages, clear_messages
 from .services.profile import load_user_profile, save_user_profile, build_me_system_prompt, update_profile_from_text
-from .utils.text import split_telegram_text, looks_like_json, is_forest_final, strip_forest_final_marker, _short_model_name
+from .utils.cache import KeyedLocks, cache_get, cache_put, single_flight
+from .utils.helpers import utc_now_iso
+from .utils.text import split_telegram_text, is_forest_final, strip_forest_final_marker, _short_model_name
 
 # Import all handlers
 from .handlers.start import start
@@ -52,11 +68,12 @@ from .mcp_weather import get_weather_via_mcp  # MCP-клиент для полу
 from .mcp_news import get_news_via_mcp  # MCP-клиент для получения новостей
 from .mcp_docker import site_up_via_mcp, site_screenshot_via_mcp, site_down_via_mcp  # MCP-клиент для управления Docker
 from .mcp_client import (
-    get_git_branch, get_pr_diff, get_pr_files, get_pr_info,  # MCP-клиент для получения git ветки и PR данных
-    user_get, user_register, user_block, user_unblock, user_delete,  # MCP-клиент для работы с пользователями
+    get_git_branch, get_pr_bundle,  # MCP-клиент для получения git ветки и PR данных
+    fetch_user_context, user_register, user_block, user_unblock, user_delete,  # MCP-клиент для работы с пользователями
     reg_create, reg_find_by_user, reg_reschedule, reg_cancel,  # MCP-клиент для работы с записями
     task_create, task_list, task_delete,  # MCP-клиент для работы с задачами
-    deploy_check_docker, deploy_upload_image, deploy_load_image, deploy_create_compose, deploy_create_env, deploy_start_bot, deploy_check_container, deploy_stop_bot,  # MCP-клиент для деплоя
+    deploy_check_docker, deploy_upload_image, deploy_load_image, deploy_prepare_files, deploy_start_bot, deploy_check_container, deploy_stop_bot,  # MCP-клиент для деплоя
+    close_mcp_session,
 )
 
 # Импортируем функции для анализа PR из скрипта
@@ -78,16 +95,22 @@ if REVIEW_SCRIPT_PATH.exists() and PR_REVIEW_AVAILABLE:
     except ImportError as e:
         logger.warning(f"PR review functions not available: {e}")
 from .weather_subscription import start_weather_subscription, stop_weather_subscription  # Подписка на погоду
-from .embeddings import process_readme_file, process_docs_folder, search_relevant_chunks, has_embeddings, list_indexed_documents, EMBEDDING_MODEL  # Модуль для работы с эмбеддингами
+from .embeddings import process_readme_file, process_docs_folder, search_relevant_chunks, has_embeddings, list_indexed_documents, clear_all_embeddings, init_embeddings_table, EMBEDDING_MODEL  # Модуль для работы с эмбеддингами
 
 
 logger = logging.getLogger(__name__)
 
 
-def utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+def _fmt_tokens(x: int | None) -> str:
+    return str(x) if isinstance(x, int) else "n/a"
+
 
+def _format_usage_line(pt: int | None, ct: int | None, tt: int | None, req_id: str = "") -> str:
+    rid = f", id={req_id}" if req_id else ""
+    return f"Токены: запрос={_fmt_tokens(pt)}, ответ={_fmt_tokens(ct)}, всего={_fmt_tokens(tt)}{rid}"
 
+
+@lru_cache(maxsize=64)
 def _short_model_name(m: str) -> str:
     m = (m or "").strip()
     if not m:
@@ -124,6 +147,10 @@ def _get_content_from_raw(data: dict) -> str:
         return ""
 
 
+_CITY_ENDING_MAP = {"а": "е", "о": "е", "ь": "и"}
+_CITY_VOWELS = frozenset("аеёиоуыэюяь")
+
+
 def _city_prepositional_case(city: str) -> str:
     """
     Склоняет название города в предложный падеж (где? в чём?).
@@ -133,27 +160,17 @@ def _city_prepositional_case(city: str) -> str:
     if not city:
         return city
     
-    # Простая эвристика для склонения русских названий городов
-    city_lower = city.lower()
-    
-    # Если заканчивается на "а" (Москва, Самара, Тула) -> "е" (в Москве, в Самаре, в Туле)
-    if city_lower.endswith("а"):
-        return city[:-1] + "е"
-    
-    # Если заканчивается на "о" (Тула уже обработана, но на всякий случай)
-    if city_lower.endswith("о"):
-        return city[:-1] + "е"
-    
-    # Если заканчивается на "ь" (Тверь, Рязань) -> "и" (в Твери, в Рязани)
-    if city_lower.endswith("ь"):
-        return city[:-1] + "и"
-    
-    # Если заканчивается на согласную (Саратов, Томск, Новосибирск) -> "е" (в Саратове, в Томске, в Новосибирске)
-    # Проверяем последнюю букву
-    last_char = city_lower[-1]
-    if last_char not in "аеёиоуыэюяь":
+    # Простая эвристика для склонения русских названий городов:
+    # Москва -> Москве, Тверь -> Твери, Саратов -> Саратове
+    last_char = city[-1].lower()
+    ending = _CITY_ENDING_MAP.get(last_char)
+    if ending:
+        return city[:-1] + ending
+
+    # согласная на конце (Томск, Новосибирск) -> "е"
+    if last_char not in _CITY_VOWELS:
         return city + "е"
-    
+
     # Если не подошло ни одно правило, возвращаем как есть
     return city
 
@@ -330,17 +347,91 @@ DEFAULT_MEMORY_ENABLED = True  # по умолчанию память включ
 DB_PATH = Path(os.getenv("DB_PATH", str(Path(__file__).resolve().parent / "bot_memory.sqlite3")))
 MEMORY_LIMIT_MESSAGES = 30  # сколько последних сообщений хранить в контексте для LLM
 MEMORY_CHAT_MODES = ("text", "thinking", "experts", "rag")  # общая память между этими режимами
+MESSAGES_KEEP_PER_CHAT = 200  # скользящее окно на (чат, режим): более старые сообщения удаляет триггер
+
 
+# SQL горячих путей — одни и те же строки, чтобы кэш подготовленных выражений sqlite3 всегда попадал
+_SQL_INSERT_MESSAGE = "INSERT INTO messages(chat_id, mode, role, content, created_at) VALUES(?,?,?,?,?)"
+_SQL_SELECT_SETTINGS = "SELECT temperature, memory_enabled, model FROM chat_settings WHERE chat_id = ?"
+
+
+@lru_cache(maxsize=16)
+def _history_sql(modes_count: int) -> str:
+    placeholders = ",".join(["?"] * modes_count)
+    return f"""
+        SELECT role, content FROM (
+            SELECT id, role, content
+            FROM messages
+            WHERE chat_id = ? AND mode IN ({placeholders})
+            ORDER BY id DESC
+            LIMIT ?
+        )
+        ORDER BY id ASC
+    """
 
-def open_db() -> sqlite3.Connection:
+
+# Одно соединение на процесс: PRAGMA выполняются один раз, без open/close на каждый запрос.
+# Хендлеры и asyncio.to_thread ходят в БД из разных потоков, поэтому доступ — под _DB_LOCK.
+_CONN: sqlite3.Connection | None = None
+_DB_LOCK = threading.RLock()
+
+
+def _connect_db() -> sqlite3.Connection:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, isolation_level=None, cached_statements=256)
+    conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
     conn.execute("PRAGMA busy_timeout=5000;")
+    # маленькая «горячая» БД: держим страницы в памяти, читаем через mmap
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-20000;")  # ~20 МБ (отрицательное значение — в КБ)
+    conn.execute("PRAGMA mmap_size=134217728;")  # 128 МБ
+    conn.execute("PRAGMA wal_autocheckpoint=1000;")
     return conn
 
 
+def close_db() -> None:
+    global _CONN
+    with _DB_LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
+
+
+# Регистрируем один раз: close_db без открытого соединения ничего не делает,
+# а повторная регистрация при каждом переоткрытии копила бы вызовы на выходе
+atexit.register(close_db)
+
+
+@contextmanager
+def open_db():
+    """Отдаёт общее соединение (autocommit) под блокировкой; открывает его при первом вызове."""
+    global _CONN
+    with _DB_LOCK:
+        if _CONN is None:
+            _CONN = _connect_db()
+        yield _CONN
+
+
+WAL_CHECKPOINT_INTERVAL = 300  # сек
+
+
+def db_wal_checkpoint() -> None:
+    """Сбрасывает WAL в основной файл и обрезает -wal, чтобы он не рос при всплесках записи."""
+    try:
+        with open_db() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    except Exception as e:
+        logger.warning("WAL checkpoint failed: %s", e)
+
+
+async def wal_checkpoint_loop() -> None:
+    while True:
+        await asyncio.sleep(WAL_CHECKPOINT_INTERVAL)
+        await asyncio.to_thread(db_wal_checkpoint)
+
+
 def _ensure_column(conn: sqlite3.Connection, table: str, column: str, ddl: str) -> None:
     """
     ddl пример: 'ALTER TABLE chat_settings ADD COLUMN memory_enabled INTEGER NOT NULL DEFAULT 1'
@@ -365,8 +456,29 @@ def init_db() -> None:
             )
             """
         )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id)")
+        # (chat_id, mode, id) покрывает и выборку истории, и удаление по chat_id (префикс индекса)
         conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id_mode_id ON messages(chat_id, mode, id)")
+        conn.execute("DROP INDEX IF EXISTS idx_messages_chat_id_id")
+
+        # ограничиваем рост истории: после вставки удаляем всё старше MESSAGES_KEEP_PER_CHAT сообщений
+        # того же чата и режима — частые записи подписки на погоду не вытесняют историю диалога
+        conn.execute("DROP TRIGGER IF EXISTS trim_messages")
+        conn.execute(
+            f"""
+            CREATE TRIGGER trim_messages AFTER INSERT ON messages
+            BEGIN
+              DELETE FROM messages
+              WHERE chat_id = NEW.chat_id
+                AND mode = NEW.mode
+                AND id <= (
+                  SELECT id FROM messages
+                  WHERE chat_id = NEW.chat_id AND mode = NEW.mode
+                  ORDER BY id DESC
+                  LIMIT 1 OFFSET {int(MESSAGES_KEEP_PER_CHAT)}
+                );
+            END
+            """
+        )
 
         conn.execute(
             """
@@ -392,17 +504,41 @@ def init_db() -> None:
             ddl="ALTER TABLE chat_settings ADD COLUMN model TEXT",
         )
 
-        conn.commit()
+
+# chat_id -> (temperature, memory_enabled, model); настройки меняются редко, читаются на каждом сообщении
+_SETTINGS_CACHE: dict[int, tuple[float | None, bool | None, str | None]] = {}
+_SETTINGS_LOCK = threading.Lock()
+_settings_generation = 0  # растёт при каждой записи: не кладём в кэш результат чтения, начатого до неё
+
+
+def _invalidate_chat_settings(chat_id: int) -> None:
+    global _settings_generation
+    with _SETTINGS_LOCK:
+        _SETTINGS_CACHE.pop(int(chat_id), None)
+        _settings_generation += 1
 
 
 def db_get_chat_settings(chat_id: int) -> tuple[float | None, bool | None, str | None]:
+    with _SETTINGS_LOCK:
+        cached = _SETTINGS_CACHE.get(int(chat_id))
+        generation = _settings_generation
+    if cached is not None:
+        return cached
+
+    settings = _db_read_chat_settings(chat_id)
+    if settings is None:
+        return None, None, None
+    with _SETTINGS_LOCK:
+        if generation == _settings_generation:
+            _SETTINGS_CACHE[int(chat_id)] = settings
+    return settings
+
+
+def _db_read_chat_settings(chat_id: int) -> tuple[float | None, bool | None, str | None] | None:
+    """SELECT настроек; None — если чтение упало (такой результат не кэшируется)."""
     try:
         with open_db() as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.execute(
-                "SELECT temperature, memory_enabled, model FROM chat_settings WHERE chat_id = ?",
-                (int(chat_id),),
-            )
+            cur = conn.execute(_SQL_SELECT_SETTINGS, (int(chat_id),))
             row = cur.fetchone()
             if not row:
                 return None, None, None
@@ -430,15 +566,12 @@ def db_get_chat_settings(chat_id: int) -> tuple[float | None, bool | None, str |
             return temp, mem, model
     except Exception as e:
         logger.exception("DB get settings failed: %s", e)
-        return None, None, None
+        return None
 
 
 def db_set_temperature(chat_id: int, temperature: float) -> None:
     try:
-        old_temp, old_mem, old_model = db_get_chat_settings(chat_id)
-        mem_val = int(old_mem) if isinstance(old_mem, bool) else int(DEFAULT_MEMORY_ENABLED)
-        model_val = (old_model or "").strip() or None
-
+        # значения остальных колонок нужны только при вставке новой строки
         with open_db() as conn:
             conn.execute(
                 """
@@ -448,19 +581,17 @@ def db_set_temperature(chat_id: int, temperature: float) -> None:
                   temperature=excluded.temperature,
                   updated_at=excluded.updated_at
                 """,
-                (int(chat_id), float(temperature), int(mem_val), model_val, utc_now_iso()),
+                (int(chat_id), float(temperature), int(DEFAULT_MEMORY_ENABLED), None, utc_now_iso()),
             )
-            conn.commit()
     except Exception as e:
         logger.exception("DB set temperature failed: %s", e)
+    finally:
+        _invalidate_chat_settings(chat_id)
 
 
 def db_set_memory_enabled(chat_id: int, enabled: bool) -> None:
     try:
-        old_temp, old_mem, old_model = db_get_chat_settings(chat_id)
-        temp_val = float(old_temp) if isinstance(old_temp, (int, float)) else float(DEFAULT_TEMPERATURE)
-        model_val = (old_model or "").strip() or None
-
+        # значения остальных колонок нужны только при вставке новой строки
         with open_db() as conn:
             conn.execute(
                 """
@@ -470,20 +601,19 @@ def db_set_memory_enabled(chat_id: int, enabled: bool) -> None:
                   memory_enabled=excluded.memory_enabled,
                   updated_at=excluded.updated_at
                 """,
-                (int(chat_id), float(temp_val), int(bool(enabled)), model_val, utc_now_iso()),
+                (int(chat_id), float(DEFAULT_TEMPERATURE), int(bool(enabled)), None, utc_now_iso()),
             )
-            conn.commit()
     except Exception as e:
         logger.exception("DB set memory_enabled failed: %s", e)
+    finally:
+        _invalidate_chat_settings(chat_id)
 
 
 def db_set_model(chat_id: int, model: str) -> None:
     try:
-        old_temp, old_mem, old_model = db_get_chat_settings(chat_id)
-        temp_val = float(old_temp) if isinstance(old_temp, (int, float)) else float(DEFAULT_TEMPERATURE)
-        mem_val = int(old_mem) if isinstance(old_mem, bool) else int(DEFAULT_MEMORY_ENABLED)
         model_val = (model or "").strip() or None
 
+        # значения остальных колонок нужны только при вставке новой строки
         with open_db() as conn:
             conn.execute(
                 """
@@ -493,11 +623,12 @@ def db_set_model(chat_id: int, model: str) -> None:
                   model=excluded.model,
                   updated_at=excluded.updated_at
                 """,
-                (int(chat_id), float(temp_val), int(mem_val), model_val, utc_now_iso()),
+                (int(chat_id), float(DEFAULT_TEMPERATURE), int(DEFAULT_MEMORY_ENABLED), model_val, utc_now_iso()),
             )
-            conn.commit()
     except Exception as e:
         logger.exception("DB set model failed: %s", e)
+    finally:
+        _invalidate_chat_settings(chat_id)
 
 
 def db_get_temperature(chat_id: int) -> float | None:
@@ -515,32 +646,38 @@ def db_get_model(chat_id: int) -> str | None:
     return m
 
 
-def get_temperature(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> float:
-    t = context.user_data.get("temperature", None)
-    if isinstance(t, (int, float)):
-        return float(t)
+def warm_user_data(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+    """
+    Один запрос настроек чата (или попадание в кэш) заполняет temperature/memory_enabled/model
+    в user_data разом, вместо трёх отдельных SELECT из каждого геттера.
+    """
+    ud = context.user_data
+    if ud.get("settings_warm"):
+        return
+    db_t, db_mem, db_model = db_get_chat_settings(chat_id)
+    if not isinstance(ud.get("temperature"), (int, float)):
+        ud["temperature"] = float(db_t) if isinstance(db_t, (int, float)) else float(DEFAULT_TEMPERATURE)
+    if not isinstance(ud.get("memory_enabled"), bool):
+        ud["memory_enabled"] = bool(db_mem) if isinstance(db_mem, bool) else bool(DEFAULT_MEMORY_ENABLED)
+    if not (isinstance(ud.get("model"), str) and ud["model"].strip()) and isinstance(db_model, str) and db_model.strip():
+        ud["model"] = db_model.strip()
+    ud["settings_warm"] = True
 
-    db_t = db_get_temperature(chat_id)
-    if isinstance(db_t, (int, float)):
-        context.user_data["temperature"] = float(db_t)
-        return float(db_t)
 
-    context.user_data["temperature"] = float(DEFAULT_TEMPERATURE)
-    return float(DEFAULT_TEMPERATURE)
+def get_temperature(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> float:
+    t = context.user_data.get("temperature", None)
+    if not isinstance(t, (int, float)):
+        warm_user_data(context, chat_id)
+        t = context.user_data.get("temperature", DEFAULT_TEMPERATURE)
+    return float(t)
 
 
 def get_memory_enabled(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> bool:
     v = context.user_data.get("memory_enabled", None)
-    if isinstance(v, bool):
-        return v
-
-    db_v = db_get_memory_enabled(chat_id)
-    if isinstance(db_v, bool):
-        context.user_data["memory_enabled"] = bool(db_v)
-        return bool(db_v)
-
-    context.user_data["memory_enabled"] = bool(DEFAULT_MEMORY_ENABLED)
-    return bool(DEFAULT_MEMORY_ENABLED)
+    if not isinstance(v, bool):
+        warm_user_data(context, chat_id)
+        v = context.user_data.get("memory_enabled", DEFAULT_MEMORY_ENABLED)
+    return bool(v)
 
 
 def get_model(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> str:
@@ -548,18 +685,37 @@ def get_model(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> str:
     if isinstance(v, str) and v.strip():
         return v.strip()
 
-    db_v = db_get_model(chat_id)
-    if isinstance(db_v, str) and db_v.strip():
-        context.user_data["model"] = db_v.strip()
-        return db_v.strip()
+    warm_user_data(context, chat_id)
+    v = context.user_data.get("model", None)
+    if isinstance(v, str) and v.strip():
+        return v.strip()
 
     # пустая строка => openrouter.py возьмёт OPENROUTER_MODEL из config
     return ""
 
 
 def get_effective_model(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> str:
-    selected = get_model(context, chat_id)
-    return selected if selected else OPENROUTER_MODEL
+    # effective_model обновляют /model_glm, /model_gemma и /mode_text;
+    # "" означает модель по умолчанию (OPENROUTER_MODEL из .env на момент запуска)
+    cached = context.user_data.get("effective_model")
+    if cached is None:
+        cached = context.user_data["effective_model"] = get_model(context, chat_id)
+    return cached or OPENROUTER_MODEL
+
+
+def get_chat_settings(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> tuple[float, str | None, bool]:
+    """
+    (temperature, model или None, memory_enabled) одним обращением к user_data.
+    Кэш chat_cfg сбрасывают команды, меняющие температуру, модель или память.
+    """
+    cfg = context.user_data.get("chat_cfg")
+    if cfg is None:
+        cfg = context.user_data["chat_cfg"] = (
+            get_temperature(context, chat_id),
+            get_model(context, chat_id) or None,
+            get_memory_enabled(context, chat_id),
+        )
+    return cfg
 
 
 def clamp_temperature(value: float) -> float:
@@ -576,43 +732,58 @@ def db_add_message(chat_id: int, mode: str, role: str, content: str) -> None:
         return
     try:
         with open_db() as conn:
-            conn.execute(
-                "INSERT INTO messages(chat_id, mode, role, content, created_at) VALUES(?,?,?,?,?)",
-                (int(chat_id), str(mode), str(role), content, utc_now_iso()),
-            )
-            conn.commit()
+            conn.execute(_SQL_INSERT_MESSAGE, (int(chat_id), str(mode), str(role), content, utc_now_iso()))
     except Exception as e:
         logger.exception("DB add failed: %s", e)
+    finally:
+        bump_history_version(chat_id)
+
+
+def db_add_messages_batch(chat_id: int, mode: str, rows: list[tuple[str, str]]) -> None:
+    """Пишет несколько сообщений (обычно user + assistant за один ход) в одной транзакции."""
+    now = utc_now_iso()
+    params = [
+        (int(chat_id), str(mode), str(role), content, now)
+        for role, text in rows
+        if (content := (text or "").strip())
+    ]
+    if not params:
+        return
+    try:
+        with open_db() as conn:
+            # соединение в autocommit: явная транзакция — один коммит (и fsync) на весь ход
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(_SQL_INSERT_MESSAGE, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    except Exception as e:
+        logger.exception("DB add batch failed: %s", e)
+    finally:
+        bump_history_version(chat_id)
 
 
 def db_clear_history(chat_id: int) -> None:
     try:
         with open_db() as conn:
             conn.execute("DELETE FROM messages WHERE chat_id = ?", (int(chat_id),))
-            conn.commit()
     except Exception as e:
         logger.exception("DB clear history failed: %s", e)
+    finally:
+        bump_history_version(chat_id)
 
 
 def db_get_history(chat_id: int, modes: tuple[str, ...], limit: int) -> list[dict]:
-    placeholders = ",".join(["?"] * len(modes))
-    sql = f"""
-        SELECT role, content
-        FROM messages
-        WHERE chat_id = ? AND mode IN ({placeholders})
-        ORDER BY id DESC
-        LIMIT ?
-    """
     try:
         with open_db() as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.execute(sql, (int(chat_id), *modes, int(limit)))
+            cur = conn.execute(_history_sql(len(modes)), (int(chat_id), *modes, int(limit)))
             rows = cur.fetchall()
     except Exception as e:
         logger.exception("DB read failed: %s", e)
         return []
 
-    rows = list(reversed(rows))
     out: list[dict] = []
     for r in rows:
         role = (r["role"] or "").strip()
@@ -624,7 +795,46 @@ def db_get_history(chat_id: int, modes: tuple[str, ...], limit: int) -> list[dic
 
 def build_messages_with_db_memory(system_prompt: str, chat_id: int) -> list[dict]:
     history = db_get_history(chat_id=chat_id, modes=MEMORY_CHAT_MODES, limit=MEMORY_LIMIT_MESSAGES)
-    return [{"role": "system", "content": system_prompt}] + history
+    return [system_message(system_prompt)] + history
+
+
+# Кэш собранного контекста (system + история) по чату. Версия истории чата растёт при каждой
+# записи/очистке/сжатии через функции этого модуля; пока она не изменилась, повторная сборка
+# не ходит в SQLite.
+HISTORY_CACHE_MAXSIZE = 1024
+_HISTORY_CACHE: "OrderedDict[tuple, tuple[int, tuple[dict, ...]]]" = OrderedDict()
+_HISTORY_VERSION: dict[int, int] = {}
+_HISTORY_LOCK = threading.Lock()
+
+
+def bump_history_version(chat_id: int) -> None:
+    with _HISTORY_LOCK:
+        chat_id = int(chat_id)
+        _HISTORY_VERSION[chat_id] = _HISTORY_VERSION.get(chat_id, 0) + 1
+
+
+def build_messages_cached(builder, system_prompt: str, chat_id: int, **kwargs) -> list[dict]:
+    """
+    Обёртка над build_messages_with_db_memory / build_messages_with_summary:
+    отдаёт копию ранее собранного списка, если история чата с тех пор не менялась.
+    """
+    chat_id = int(chat_id)
+    key = (builder.__name__, chat_id, system_prompt, tuple(sorted(kwargs.items())))
+    with _HISTORY_LOCK:
+        version = _HISTORY_VERSION.get(chat_id, 0)
+        entry = _HISTORY_CACHE.get(key)
+        if entry is not None and entry[0] == version:
+            _HISTORY_CACHE.move_to_end(key)
+            return list(entry[1])
+
+    # собираем вне lock; если за это время была запись, версия уже другая и запись не попадёт в кэш как свежая
+    messages = builder(system_prompt, chat_id=chat_id, **kwargs)
+    with _HISTORY_LOCK:
+        _HISTORY_CACHE[key] = (version, tuple(messages))
+        _HISTORY_CACHE.move_to_end(key)
+        while len(_HISTORY_CACHE) > HISTORY_CACHE_MAXSIZE:
+            _HISTORY_CACHE.popitem(last=False)
+    return list(messages)
 
 
 # -------------------- PROMPTS --------------------
@@ -764,6 +974,32 @@ SYSTEM_PROMPT_EXPERTS = """
 - Пиши кратко, но так, чтобы было ясно, почему итог верный.
 """
 
+SYSTEM_PROMPT_CSO = """
+Ты ведёшь сжатое состояние диалога (Context State Object).
+Тебе дают текущее состояние и последний обмен репликами (вопрос ассистента и ответ пользователя).
+Верни 1–2 строки-буллета, начинающиеся с "- ", которые фиксируют только НОВЫЕ факты из последнего обмена.
+Не повторяй то, что уже есть в состоянии. Без вступлений и пояснений.
+"""
+
+# Системные сообщения собираем один раз: одинаковый префикс запроса байт-в-байт
+# позволяет провайдеру (OpenRouter) переиспользовать кэш промпта. Не мутировать!
+SYS_JSON_MSG = {"role": "system", "content": SYSTEM_PROMPT_JSON}
+SYS_TEXT_MSG = {"role": "system", "content": SYSTEM_PROMPT_TEXT}
+SYS_TZ_MSG = {"role": "system", "content": SYSTEM_PROMPT_TZ}
+SYS_FOREST_MSG = {"role": "system", "content": SYSTEM_PROMPT_FOREST}
+SYS_THINKING_MSG = {"role": "system", "content": SYSTEM_PROMPT_THINKING}
+SYS_EXPERTS_MSG = {"role": "system", "content": SYSTEM_PROMPT_EXPERTS}
+SYS_CSO_MSG = {"role": "system", "content": SYSTEM_PROMPT_CSO}
+
+_SYSTEM_MESSAGES = {m["content"]: m for m in (
+    SYS_JSON_MSG, SYS_TEXT_MSG, SYS_TZ_MSG, SYS_FOREST_MSG, SYS_THINKING_MSG, SYS_EXPERTS_MSG, SYS_CSO_MSG,
+)}
+
+
+def system_message(system_prompt: str) -> dict:
+    """Возвращает общий dict для известных промптов, для остальных — новый."""
+    return _SYSTEM_MESSAGES.get(system_prompt) or {"role": "system", "content": system_prompt}
+
 
 # -------------------- HELPERS --------------------
 
@@ -778,27 +1014,73 @@ def split_telegram_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[
     if len(t) <= limit:
         return [t]
 
+    # режем по индексам исходной строки, без копий хвоста на каждой итерации
     parts: list[str] = []
-    cur = t
-    while len(cur) > limit:
-        cut = cur.rfind("\n", 0, limit)
-        if cut < 200:
-            cut = limit
-        parts.append(cur[:cut].rstrip())
-        cur = cur[cut:].lstrip()
-    if cur:
-        parts.append(cur)
+    start, n = 0, len(t)
+    while n - start > limit:
+        cut = t.rfind("\n", start, start + limit)
+        if cut - start < 200:
+            cut = start + limit
+        parts.append(t[start:cut].rstrip())
+        start = cut
+        while start < n and t[start].isspace():
+            start += 1
+    if start < n:
+        parts.append(t[start:])
     return parts
 
 
+class SendRateLimiter:
+    """Token bucket: не больше rate отправок за period секунд, лишние ждут своей очереди."""
+
+    def __init__(self, rate: int, period: float = 1.0) -> None:
+        self._rate = float(rate)
+        self._period = float(period)
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._rate, self._tokens + (now - self._updated) * self._rate / self._period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self._period / self._rate)
+
+    async def __aexit__(self, *exc) -> bool:
+        return False
+
+
+# Telegram пускает ~30 исходящих сообщений/сек на бота; 5/сек оставляем прочим вызовам API
+SEND_LIMITER = SendRateLimiter(25, 1.0)
+
+
+async def _send_limited(send, *args, **kwargs):
+    """Отправка через SEND_LIMITER; на RetryAfter ждём указанное время и пробуем ещё раз."""
+    async with SEND_LIMITER:
+        try:
+            return await send(*args, **kwargs)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            await asyncio.sleep(float(delay))
+    async with SEND_LIMITER:
+        return await send(*args, **kwargs)
+
+
 async def safe_reply_text(update: Update, text: str, parse_mode: str | None = None) -> None:
     if not update.message:
         return
 
     chunks = split_telegram_text(text)
+    # Куски шлём строго по очереди: параллельные sendMessage Telegram может доставить
+    # в другом порядке, а это части одного ответа. Темп задаёт SEND_LIMITER.
     for ch in chunks:
         try:
-            await update.message.reply_text(ch, parse_mode=parse_mode)
+            await _send_limited(update.message.reply_text, ch, parse_mode=parse_mode)
         except TimedOut:
             return
         except BadRequest as e:
@@ -806,7 +1088,7 @@ async def safe_reply_text(update: Update, text: str, parse_mode: str | None = No
             if "message is too long" in msg and len(ch) > 500:
                 for sub in split_telegram_text(ch, limit=2000):
                     try:
-                        await update.message.reply_text(sub, parse_mode=parse_mode)
+                        await _send_limited(update.message.reply_text, sub, parse_mode=parse_mode)
                     except Exception:
                         return
                 continue
@@ -815,13 +1097,251 @@ async def safe_reply_text(update: Update, text: str, parse_mode: str | None = No
             return
 
 
+STREAM_EDIT_INTERVAL = 0.3  # сек между правками сообщения (лимиты Telegram)
+STREAM_EDIT_MIN_CHARS = 40
+STREAM_CURSOR = "▌"
+STREAM_TRUNCATED_MARK = "\n\n⚠️ Ответ оборван: ошибка при генерации."
+
+
+async def _edit_stream_message(message, text: str) -> bool:
+    """Правит сообщение стрима; False, если правка не удалась (вызывающий решает, что делать дальше)."""
+    try:
+        await _send_limited(message.edit_text, text)
+    except BadRequest as e:
+        if "message is not modified" in str(e).lower():
+            return True
+        logger.warning(f"Stream edit failed: {e}")
+        return False
+    except Exception as e:
+        # RetryAfter после повтора, NetworkError, TimedOut: промежуточную правку просто пропускаем
+        logger.warning(f"Stream edit failed: {e}")
+        return False
+    return True
+
+
+async def stream_reply_text(update: Update, messages: list[dict], temperature: float, model: str | None,
+                            view=None) -> tuple[str, Exception | None]:
+    """
+    Отвечает потоково: сразу шлёт заглушку и правит её по мере генерации
+    (не чаще STREAM_EDIT_INTERVAL и не меньше STREAM_EDIT_MIN_CHARS новых символов).
+
+    view(text, final) превращает накопленный ответ в текст для показа; None — пока ничего не показывать
+    (например, в лесу первая строка может оказаться маркером FINAL).
+    Возвращает (полный ответ, ошибка генерации). Если ответ оборван ошибкой, показанный текст
+    помечается STREAM_TRUNCATED_MARK. При ошибке до первого токена заглушка удаляется, исключение пробрасывается.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def produce() -> None:
+        try:
+            for piece in chat_completion_stream(messages, temperature=temperature, model=model):
+                loop.call_soon_threadsafe(queue.put_nowait, piece)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        placeholder = await _send_limited(update.message.reply_text, STREAM_CURSOR)
+    except Exception as e:
+        # без заглушки промежуточных правок нет: ответ уйдёт обычными сообщениями в конце
+        logger.warning(f"Stream placeholder failed: {e}")
+        placeholder = None
+
+    answer = ""
+    shown_len = 0
+    last_edit = loop.time()
+    error: Exception | None = None
+    while True:
+        item = await queue.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            error = item
+            continue
+        answer += item
+        now = loop.time()
+        if placeholder is not None and len(answer) - shown_len >= STREAM_EDIT_MIN_CHARS and now - last_edit >= STREAM_EDIT_INTERVAL:
+            shown_len = len(answer)
+            last_edit = now
+            shown = view(answer, False) if view else answer
+            if shown:
+                await _edit_stream_message(placeholder, shown[:TELEGRAM_MESSAGE_LIMIT - len(STREAM_CURSOR)] + STREAM_CURSOR)
+    await producer
+
+    answer = answer.strip()
+    if error is not None and not answer:
+        if placeholder is not None:
+            try:
+                await placeholder.delete()
+            except Exception:
+                pass
+        raise error
+
+    final_text = (view(answer, True) if view else answer) or "Пустой ответ от модели."
+    if error is not None:
+        logger.warning(f"Stream interrupted: {error}")
+        final_text += STREAM_TRUNCATED_MARK
+    chunks = split_telegram_text(final_text)
+    if placeholder is None or not await _edit_stream_message(placeholder, chunks[0]):
+        # последняя правка не прошла — доставляем текст отдельным сообщением, заглушку убираем
+        if placeholder is not None:
+            try:
+                await placeholder.delete()
+            except Exception:
+                pass
+        await safe_reply_text(update, chunks[0])
+    for ch in chunks[1:]:
+        try:
+            await _send_limited(update.message.reply_text, ch)
+        except Exception:
+            await safe_reply_text(update, ch)
+    return answer, error
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _send_typing_action(chat) -> None:
+    try:
+        await chat.send_action("typing")
+    except Exception:
+        pass  # индикатор «печатает» — не критичен
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """create_task с удержанием ссылки до завершения (иначе задачу может собрать GC)."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def send_typing(update: Update) -> None:
+    """Шлёт «печатает» в фоне, не дожидаясь ответа Telegram (минус один RTT перед запросом к LLM)."""
+    if not update.message:
+        return
+    spawn_background(_send_typing_action(update.message.chat))
+
+
+def _persist_turn(chat_id: int, mode: str, user_text: str, answer: str, compress: bool = True) -> None:
+    """Пишет реплики пользователя и ассистента одной транзакцией и при необходимости сжимает историю."""
+    try:
+        db_add_messages_batch(chat_id, mode, [("user", user_text), ("assistant", answer)])
+    except Exception:
+        logger.exception(f"Failed to persist turn for chat {chat_id}")
+        return
+    if compress:
+        try:
+            if maybe_compress_history(chat_id, temperature=0.0, mode=mode):
+                bump_history_version(chat_id)  # summary обновилось, старые сообщения удалены
+        except Exception:
+            pass
+
+
+def persist_turn_background(chat_id: int, mode: str, user_text: str, answer: str, compress: bool = True) -> None:
+    """
+    Сохраняет ход диалога в фоне: ответ уходит пользователю сразу, а запись в SQLite
+    и сжатие истории (там ещё один запрос к LLM) выполняются в отдельном потоке.
+    """
+    spawn_background(asyncio.to_thread(_persist_turn, chat_id, mode, user_text, answer, compress))
+
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def _scan_json_object(text: str) -> str | None:
+    """
+    Один линейный проход: от первой '{' до парной '}' с учётом строк и экранирования.
+    Если объект не закрыт (обрезанный ответ) — как раньше, до последней '}'.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_str = False
+    escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    end = text.rfind("}")
+    return text[start:end + 1] if end > start else None
+
+
 def extract_json_object(text: str) -> str:
     text = (text or "").strip()
-    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text, flags=re.IGNORECASE)
-    m = re.search(r"\{.*\}", text, flags=re.DOTALL)
-    if not m:
+    # частый случай: модель вернула чистый JSON без ограждений
+    if text.startswith("{") and text.endswith("}"):
+        return text
+    text = _FENCE_RE.sub("", text)
+    obj = _scan_json_object(text)
+    if obj is None:
         raise ValueError("JSON object not found in model output")
-    return m.group(0)
+    return obj
+
+
+# Неизменяемый шаблон ответа-ошибки для JSON-режимов; меняются только time/answer/warnings
+_ERR_PAYLOAD_TEMPLATE = MappingProxyType({
+    "title": "Ошибка",
+    "time": "",
+    "tag": "error",
+    "answer": "Модель вернула непарсируемый формат.",
+    "steps": (),
+    "warnings": (),
+    "need_clarification": False,
+    "clarifying_question": "",
+})
+
+
+# Ответ /mode_json отличается только временем: JSON сериализуем один раз, в ответе подставляем время
+_PAYLOAD_TIME_TOKEN = "__TIME__"
+_MODE_JSON_SET_PAYLOAD = MappingProxyType({
+    "title": "Режим установлен",
+    "time": "",
+    "tag": "system",
+    "answer": "Ок. Режим установлен: json",
+    "steps": (),
+    "warnings": (),
+    "need_clarification": False,
+    "clarifying_question": "",
+})
+_MODE_JSON_SET_TEXT = json.dumps(
+    {**_MODE_JSON_SET_PAYLOAD, "time": _PAYLOAD_TIME_TOKEN, "steps": [], "warnings": []},
+    ensure_ascii=False,
+    indent=2,
+)
+
+
+def dumps_payload(payload: dict) -> str:
+    """JSON-ответ пользователю: отступ 2, кириллица без \\u-экранирования."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False, indent=2)
+
+
+def loads_json(text: str):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def build_error_payload(answer: str, error: Exception) -> dict:
+    return {**_ERR_PAYLOAD_TEMPLATE, "time": utc_now_iso(), "answer": answer, "warnings": [str(error)]}
 
 
 def normalize_payload(data: dict) -> dict:
@@ -836,13 +1356,11 @@ def normalize_payload(data: dict) -> dict:
         "clarifying_question": str(data.get("clarifying_question", "")).strip(),
     }
 
-    if not isinstance(normalized["steps"], list):
-        normalized["steps"] = []
-    if not isinstance(normalized["warnings"], list):
-        normalized["warnings"] = []
+    raw_steps = normalized["steps"] if isinstance(normalized["steps"], list) else []
+    raw_warnings = normalized["warnings"] if isinstance(normalized["warnings"], list) else []
 
-    normalized["steps"] = [str(x).strip() for x in normalized["steps"] if str(x).strip()]
-    normalized["warnings"] = [str(x).strip() for x in normalized["warnings"] if str(x).strip()]
+    normalized["steps"] = [t for x in raw_steps if (t := str(x).strip())]
+    normalized["warnings"] = [t for x in raw_warnings if (t := str(x).strip())]
 
     if normalized["need_clarification"]:
         if not normalized["clarifying_question"]:
@@ -874,18 +1392,100 @@ def repair_json_with_model(system_prompt: str, raw: str, temperature: float, mod
     return fixed
 
 
+def update_context_state(cso: str, question: str, answer: str, model: str | None) -> str:
+    """
+    Дописывает в сжатое состояние диалога (CSO) дельту с новыми фактами: cso_t = cso_{t-1} + Δ_t.
+    Вместо полной истории в модель уходит только CSO, поэтому стоимость хода почти не растёт.
+    """
+    exchange = f"Вопрос ассистента: {question}\nОтвет пользователя: {answer}"
+    try:
+        delta = (chat_completion(
+            [
+                SYS_CSO_MSG,
+                {"role": "user", "content": f"Текущее состояние:\n{cso or '(пусто)'}\n\n{exchange}"},
+            ],
+            temperature=0.0,
+            model=model,
+        ) or "").strip()
+    except Exception as e:
+        logger.warning(f"CSO update failed, keeping raw answer: {e}")
+        delta = ""
+    if not delta:
+        delta = f"- {answer.strip()}"
+    return f"{cso}\n{delta}".strip() if cso else delta
+
+
+# Пошаговые сценарии (ТЗ/лес): храним не больше N последних пар «вопрос-ответ» и не больше ~N токенов.
+# maxlen чётный: deque вытесняет реплики парами и не оставляет ответ без вопроса
+DIALOG_HISTORY_MAX_PAIRS = 8
+DIALOG_HISTORY_MAX_MESSAGES = 2 * DIALOG_HISTORY_MAX_PAIRS
+DIALOG_HISTORY_TOKEN_BUDGET = 4000
+
+
+def new_dialog_history(items=None) -> deque:
+    return deque(items or [], maxlen=DIALOG_HISTORY_MAX_MESSAGES)
+
+
+def get_dialog_history(user_data: dict, key: str) -> deque:
+    """
+    История сценария из user_data без копирования: хранимый deque изменяется на месте.
+    Список (сессия из старой версии/персистентности) один раз переводится в deque.
+    """
+    history = user_data.get(key)
+    if not isinstance(history, deque) or history.maxlen != DIALOG_HISTORY_MAX_MESSAGES:
+        history = user_data[key] = new_dialog_history(history)
+    return history
+
+
+def trim_dialog_history(history: deque, token_budget: int = DIALOG_HISTORY_TOKEN_BUDGET) -> deque:
+    """
+    Отбрасывает самые старые реплики, пока грубая оценка токенов (len // 4) выше бюджета.
+    Вопрос пользователя удаляется вместе с ответом ассистента на него, чтобы в истории
+    не оставалось ответа без вопроса.
+    """
+    total = sum(len(m.get("content") or "") // 4 for m in history)
+    while len(history) > 1 and total > token_budget:
+        dropped = history.popleft()
+        total -= len(dropped.get("content") or "") // 4
+        if dropped.get("role") == "user" and len(history) > 1 and history[0].get("role") == "assistant":
+            total -= len(history.popleft().get("content") or "") // 4
+    return history
+
+
+def build_cso_messages(system_prompt: str, cso: str, history: list[dict], user_text: str) -> list[dict]:
+    """
+    Собирает запрос для пошаговых сценариев (ТЗ/лес): системный промпт, CSO,
+    последний вопрос ассистента и новая реплика пользователя. Без CSO — полная история.
+    """
+    messages = [system_message(system_prompt)]
+    if not cso:
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_text})
+        return messages
+    messages.append({"role": "system", "content": f"Собранные факты (сжатое состояние диалога):\n{cso}"})
+    last_assistant = next((m for m in reversed(history) if m.get("role") == "assistant"), None)
+    if last_assistant:
+        messages.append(last_assistant)
+    messages.append({"role": "user", "content": user_text})
+    return messages
+
+
 def get_mode(context: ContextTypes.DEFAULT_TYPE) -> str:
     return context.user_data.get("mode", "text")  # text | json | tz | forest | thinking | experts | summary
 
 
-def looks_like_json(text: str) -> bool:
-    t = (text or "").lstrip()
-    return (t.startswith("{") and t.endswith("}")) or t.startswith("{")
+def _first_non_space(text: str) -> int:
+    # индекс первого непробельного символа без копии строки (в отличие от lstrip)
+    i, n = 0, len(text)
+    while i < n and text[i].isspace():
+        i += 1
+    return i
 
 
 def is_forest_final(text: str) -> bool:
-    t = (text or "").lstrip()
-    return t.upper().startswith("FINAL")
+    t = text or ""
+    i = _first_non_space(t)
+    return t[i:i + 5].upper() == "FINAL"
 
 
 def strip_forest_final_marker(text: str) -> str:
@@ -897,34 +1497,38 @@ def strip_forest_final_marker(text: str) -> str:
     return (text or "").strip()
 
 
+_SHOW_RESULT_RE = re.compile(r"покажи|выведи|результат|расч|итог|финал|переводы|кто кому", re.IGNORECASE)
+
+
 def user_asked_to_show_result(user_text: str) -> bool:
-    t = (user_text or "").strip().lower()
-    keywords = ["покажи", "выведи", "результат", "расч", "итог", "финал", "переводы", "кто кому"]
-    return any(k in t for k in keywords)
+    return bool(_SHOW_RESULT_RE.search(user_text or ""))
+
+
+TZ_SESSION_KEYS = ("tz_history", "tz_questions", "tz_done", "tz_cso")
+FOREST_SESSION_KEYS = ("forest_history", "forest_questions", "forest_done", "forest_result", "forest_cso")
+SESSION_KEYS = TZ_SESSION_KEYS + FOREST_SESSION_KEYS
+OLLAMA_SETTINGS_KEYS = ("ollama_temperature", "ollama_num_ctx", "ollama_num_predict", "ollama_system_prompt")
+
+
+def reset_session(user_data: dict, keys: tuple[str, ...] = SESSION_KEYS, keep: tuple[str, ...] = ()) -> None:
+    """Сбрасывает состояние сценариев одним проходом (по умолчанию и ТЗ, и лес)."""
+    for k in keys:
+        if k not in keep and k in user_data:
+            del user_data[k]
 
 
 def reset_tz(context: ContextTypes.DEFAULT_TYPE) -> None:
-    context.user_data.pop("tz_history", None)
-    context.user_data.pop("tz_questions", None)
-    context.user_data.pop("tz_done", None)
+    reset_session(context.user_data, TZ_SESSION_KEYS)
 
 
 def reset_forest(context: ContextTypes.DEFAULT_TYPE) -> None:
-    context.user_data.pop("forest_history", None)
-    context.user_data.pop("forest_questions", None)
-    context.user_data.pop("forest_done", None)
-    context.user_data.pop("forest_result", None)
+    reset_session(context.user_data, FOREST_SESSION_KEYS)
 
 
 # -------------------- COMMANDS --------------------
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    mode = get_mode(context)
-    chat_id = int(update.effective_chat.id) if update.effective_chat else 0
-    t = get_temperature(context, chat_id)
-    mem = get_memory_enabled(context, chat_id)
-    current_model = get_effective_model(context, chat_id)
-
+# Статическая часть /start и /help: команды и модели из env известны при импорте
+def _build_start_menu_lines() -> tuple[str, ...]:
     lines = [
         "Привет! 👋",
         "",
@@ -1006,14 +1610,106 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "📖 Справка:",
         "/help — показать список команд или ответить на вопрос о проекте",
     ])
+    return tuple(lines)
 
-    lines.extend([
+
+def _build_help_menu_text() -> str:
+    lines = [
+        "📋 Доступные команды:",
+        "",
+        "🔧 Основные режимы:",
+        f"/mode_text — режим text + {_short_model_name(OPENROUTER_MODEL)}",
+        "/mode_json — JSON на каждое сообщение",
+        f"/mode_summary — режим summary + {_short_model_name(OPENROUTER_MODEL)} (сжатие истории)",
+        "/summary_debug — показать текущее summary (режим summary)",
+        "",
+        "🤖 Специальные режимы:",
+        "/tz_creation_site — собрать ТЗ на сайт (итог JSON)",
+        "/forest_split — кто кому должен (итог текст)",
+        "/thinking_model — решать пошагово",
+        "/expert_group_model — группа экспертов",
+        "",
+        "⚙️ Настройки:",
+        "/ch_temperature — показать/изменить температуру (пример: /ch_temperature 0.7)",
+        "/ch_memory — память ВКЛ/ВЫКЛ (пример: /ch_memory off)",
+        "/clear_memory — очистить память чата",
+        "/clear_embeddings — удалить все эмбеддинги",
+        "",
+        "🧪 Тестирование:",
+        "/tokens_test — тест токенов (включить режим)",
+        "/tokens_next — тест токенов: следующий этап",
+        "/tokens_stop — тест токенов: сводка и выход",
+        "",
+        "📚 RAG и эмбеддинги:",
+        "/embed_create — создать эмбеддинги из .md файла (сначала отправьте файл)",
+        "/embed_docs — создать эмбеддинги из всех файлов в папке docs/",
+        "/rag_model — режим RAG",
+        "",
+        "💬 Словесные команды (в режиме RAG):",
+        "• \"RAG+фильтр\" или \"RAG+фильтр <вопрос>\" — поиск с порогом похожести",
+        "• \"RAG без фильтра\" или \"RAG без фильтра <вопрос>\" — поиск без порога",
+        "• \"Без RAG\" или \"Без RAG <вопрос>\" — обычный ответ без поиска",
+        "",
+        "🌤️ Погода:",
+        "/weather_sub — подписка на погоду (пример: /weather_sub Москва 30)",
+        "/weather_sub_stop — остановить подписку (пример: /weather_sub_stop Москва)",
+        "/digest — утренняя сводка: погода + новости (пример: /digest Москва, технологии)",
+        "",
+        "👤 Регистрация и записи:",
+        "/register — регистрация (пример: /register Иванов Иван Иванович +79991234567)",
+        "/unregister — удалить свою регистрацию",
+        "/train_signup — запись на тренировку (пример: /train_signup 15-02-2026 18:00 [примечание])",
+        "/train_move — перенос записи (пример: /train_move 1 16-02-2026 19:00)",
+        "/train_cancel — отмена записи (пример: /train_cancel 1)",
+        "/support — поддержка с RAG (пример: /support можно перенести запись?)",
+        "/task_list — режим работы с задачами (словесные команды для создания, просмотра, удаления задач)",
+        "",
+        "🎤 Голосовой ассистент:",
+        "/voice — голосовой ассистент (отправьте голосовое сообщение для распознавания и ответа, для выхода: /stop или /cancel)",
+        "",
+        "🤖 Локальные модели:",
+        "/local_model — режим локальной модели Ollama (переключение режима, затем просто пишите сообщения)",
+        "/analyze — анализ JSON файлов с логами через Ollama (отправьте JSON файл, затем задайте вопрос)",
+        "/me — персональный ассистент (использует профиль пользователя, команды: 'Обновить профиль', 'Кто я?')",
+        "",
+        "🚀 Деплой:",
+        "/deploy_bot — деплой бота на сервер (требует настройки переменных окружения)",
+        "/stop_bot — остановить бота на сервере (опции: -v удалить данные, -i удалить образы)",
+        "",
+        "📖 Справка:",
+        "/help <вопрос> — ответить на вопрос о проекте используя RAG",
+    ]
+
+    if PR_REVIEW_AVAILABLE:
+        lines.insert(-2, "/review_pr — анализ Pull Request (пример: /review_pr 123)")
+
+    if MODEL_GLM:
+        lines.insert(4, f"/model_glm — модель {_short_model_name(MODEL_GLM)}")
+    if MODEL_GEMMA:
+        lines.insert(5 if MODEL_GLM else 4, f"/model_gemma — модель {_short_model_name(MODEL_GEMMA)}")
+
+    return "\n".join(lines)
+
+
+_START_MENU_LINES = _build_start_menu_lines()
+_HELP_MENU_TEXT = _build_help_menu_text()
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    mode = get_mode(context)
+    chat_id = int(update.effective_chat.id) if update.effective_chat else 0
+    t = get_temperature(context, chat_id)
+    mem = get_memory_enabled(context, chat_id)
+    current_model = get_effective_model(context, chat_id)
+
+    lines = (
+        *_START_MENU_LINES,
         "",
         f"Текущий режим: {mode}",
         f"Температура: {t}",
         f"Память: {'ВКЛ' if mem else 'ВЫКЛ'}",
         f"Модель: {current_model}",
-    ])
+    )
 
     await safe_reply_text(update, "\n".join(lines))
 
@@ -1031,81 +1727,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     # Если аргументов нет - показываем список команд
     if not context.args:
-        lines = [
-            "📋 Доступные команды:",
-            "",
-            "🔧 Основные режимы:",
-        f"/mode_text — режим text + {_short_model_name(OPENROUTER_MODEL)}",
-        "/mode_json — JSON на каждое сообщение",
-        f"/mode_summary — режим summary + {_short_model_name(OPENROUTER_MODEL)} (сжатие истории)",
-            "/summary_debug — показать текущее summary (режим summary)",
-            "",
-            "🤖 Специальные режимы:",
-            "/tz_creation_site — собрать ТЗ на сайт (итог JSON)",
-            "/forest_split — кто кому должен (итог текст)",
-        "/thinking_model — решать пошагово",
-            "/expert_group_model — группа экспертов",
-            "",
-            "⚙️ Настройки:",
-            "/ch_temperature — показать/изменить температуру (пример: /ch_temperature 0.7)",
-            "/ch_memory — память ВКЛ/ВЫКЛ (пример: /ch_memory off)",
-            "/clear_memory — очистить память чата",
-            "/clear_embeddings — удалить все эмбеддинги",
-            "",
-            "🧪 Тестирование:",
-            "/tokens_test — тест токенов (включить режим)",
-            "/tokens_next — тест токенов: следующий этап",
-            "/tokens_stop — тест токенов: сводка и выход",
-            "",
-            "📚 RAG и эмбеддинги:",
-            "/embed_create — создать эмбеддинги из .md файла (сначала отправьте файл)",
-            "/embed_docs — создать эмбеддинги из всех файлов в папке docs/",
-            "/rag_model — режим RAG",
-            "",
-            "💬 Словесные команды (в режиме RAG):",
-            "• \"RAG+фильтр\" или \"RAG+фильтр <вопрос>\" — поиск с порогом похожести",
-            "• \"RAG без фильтра\" или \"RAG без фильтра <вопрос>\" — поиск без порога",
-            "• \"Без RAG\" или \"Без RAG <вопрос>\" — обычный ответ без поиска",
-            "",
-            "🌤️ Погода:",
-            "/weather_sub — подписка на погоду (пример: /weather_sub Москва 30)",
-            "/weather_sub_stop — остановить подписку (пример: /weather_sub_stop Москва)",
-            "/digest — утренняя сводка: погода + новости (пример: /digest Москва, технологии)",
-            "",
-            "👤 Регистрация и записи:",
-            "/register — регистрация (пример: /register Иванов Иван Иванович +79991234567)",
-            "/unregister — удалить свою регистрацию",
-            "/train_signup — запись на тренировку (пример: /train_signup 15-02-2026 18:00 [примечание])",
-            "/train_move — перенос записи (пример: /train_move 1 16-02-2026 19:00)",
-            "/train_cancel — отмена записи (пример: /train_cancel 1)",
-            "/support — поддержка с RAG (пример: /support можно перенести запись?)",
-            "/task_list — режим работы с задачами (словесные команды для создания, просмотра, удаления задач)",
-            "",
-            "🎤 Голосовой ассистент:",
-            "/voice — голосовой ассистент (отправьте голосовое сообщение для распознавания и ответа, для выхода: /stop или /cancel)",
-            "",
-            "🤖 Локальные модели:",
-            "/local_model — режим локальной модели Ollama (переключение режима, затем просто пишите сообщения)",
-            "/analyze — анализ JSON файлов с логами через Ollama (отправьте JSON файл, затем задайте вопрос)",
-            "/me — персональный ассистент (использует профиль пользователя, команды: 'Обновить профиль', 'Кто я?')",
-            "",
-            "🚀 Деплой:",
-            "/deploy_bot — деплой бота на сервер (требует настройки переменных окружения)",
-            "/stop_bot — остановить бота на сервере (опции: -v удалить данные, -i удалить образы)",
-            "",
-            "📖 Справка:",
-            "/help <вопрос> — ответить на вопрос о проекте используя RAG",
-    ]
-
-        if PR_REVIEW_AVAILABLE:
-            lines.insert(-2, "/review_pr — анализ Pull Request (пример: /review_pr 123)")
-
-        if MODEL_GLM:
-            lines.insert(4, f"/model_glm — модель {_short_model_name(MODEL_GLM)}")
-        if MODEL_GEMMA:
-            lines.insert(5 if MODEL_GLM else 4, f"/model_gemma — модель {_short_model_name(MODEL_GEMMA)}")
-
-        await safe_reply_text(update, "\n".join(lines))
+        await safe_reply_text(update, _HELP_MENU_TEXT)
         return
     
     # Если есть аргументы - используем RAG для ответа на вопрос
@@ -1114,12 +1736,10 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await safe_reply_text(update, "Пожалуйста, задайте вопрос о проекте. Пример: /help Как работает RAG система?")
         return
     
-    await update.message.chat.send_action("typing")
+    send_typing(update)
     
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
-    temperature = get_temperature(context, chat_id)
-    memory_enabled = get_memory_enabled(context, chat_id)
-    model = get_model(context, chat_id) or None
+    temperature, model, memory_enabled = get_chat_settings(context, chat_id)
     
     # Проверяем наличие эмбеддингов
     if not has_embeddings(EMBEDDING_MODEL):
@@ -1235,7 +1855,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Формируем сообщения для LLM
     system_prompt = SYSTEM_PROMPT_TEXT
     if memory_enabled:
-        messages = build_messages_with_db_memory(system_prompt, chat_id=chat_id)
+        messages = await asyncio.to_thread(build_messages_cached, build_messages_with_db_memory, system_prompt, chat_id=chat_id)
     else:
         messages = [{"role": "system", "content": system_prompt}]
     
@@ -1243,7 +1863,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     # Отправляем запрос к LLM
     try:
-        answer = chat_completion(messages, temperature=temperature, model=model)
+        answer = await asyncio.to_thread(chat_completion, messages, temperature=temperature, model=model)
         answer = (answer or "").strip() or "Пустой ответ от модели."
     except Exception as e:
         await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
@@ -1251,8 +1871,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     # Сохраняем в БД
     mode = "text"  # Используем режим text для сохранения истории
-    db_add_message(chat_id, mode, "user", f"/help {question_text}")
-    db_add_message(chat_id, mode, "assistant", answer)
+    persist_turn_background(chat_id, mode, f"/help {question_text}", answer, compress=False)
     
     await safe_reply_text(update, answer)
 
@@ -1280,7 +1899,8 @@ async def ch_temperature_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE)
     val = clamp_temperature(val)
 
     context.user_data["temperature"] = val
-    db_set_temperature(chat_id, val)
+    context.user_data.pop("chat_cfg", None)
+    await asyncio.to_thread(db_set_temperature, chat_id, val)
 
     await safe_reply_text(update, f"Ок. Температура установлена: {val}")
 
@@ -1315,20 +1935,22 @@ async def ch_memory_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     context.user_data["memory_enabled"] = enabled
-    db_set_memory_enabled(chat_id, enabled)
+    context.user_data.pop("chat_cfg", None)
+    await asyncio.to_thread(db_set_memory_enabled, chat_id, enabled)
 
     await safe_reply_text(update, f"Ок. Память: {'ВКЛ' if enabled else 'ВЫКЛ'}")
 
 
 async def clear_memory_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
-    db_clear_history(chat_id)
+    await asyncio.to_thread(db_clear_history, chat_id)
 
     # NEW: чистим summary-таблицу тоже
     try:
-        clear_summary(chat_id, mode=MODE_SUMMARY)
+        await asyncio.to_thread(clear_summary, chat_id, mode=MODE_SUMMARY)
     except Exception:
         pass
+    bump_history_version(chat_id)
 
     await safe_reply_text(update, "Ок. Память чата очищена.")
 
@@ -1336,7 +1958,6 @@ async def clear_memory_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def clear_embeddings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда для удаления всех эмбеддингов из базы данных."""
     try:
-        from .embeddings import clear_all_embeddings
         deleted_count = clear_all_embeddings()
         if deleted_count > 0:
             logger.info(f"Cleared {deleted_count} embedding chunks from database")
@@ -1354,7 +1975,9 @@ async def model_glm_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
     context.user_data["model"] = MODEL_GLM
-    db_set_model(chat_id, MODEL_GLM)
+    context.user_data["effective_model"] = MODEL_GLM
+    context.user_data.pop("chat_cfg", None)
+    await asyncio.to_thread(db_set_model, chat_id, MODEL_GLM)
     await safe_reply_text(update, f"Ок. Модель установлена: {MODEL_GLM}")
 
 
@@ -1364,7 +1987,9 @@ async def model_gemma_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
     context.user_data["model"] = MODEL_GEMMA
-    db_set_model(chat_id, MODEL_GEMMA)
+    context.user_data["effective_model"] = MODEL_GEMMA
+    context.user_data.pop("chat_cfg", None)
+    await asyncio.to_thread(db_set_model, chat_id, MODEL_GEMMA)
     await safe_reply_text(update, f"Ок. Модель установлена: {MODEL_GEMMA}")
 
 
@@ -1372,33 +1997,24 @@ async def mode_text_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
 
     context.user_data["mode"] = "text"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
 
     # Сброс на дефолтную модель из .env (OPENROUTER_MODEL)
     context.user_data.pop("model", None)
-    db_set_model(chat_id, "")
+    context.user_data["effective_model"] = ""
+    context.user_data.pop("chat_cfg", None)
+    await asyncio.to_thread(db_set_model, chat_id, "")
 
     await safe_reply_text(update, f"Ок. Режим: text. Модель: {OPENROUTER_MODEL}")
 
 
 async def mode_json_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["mode"] = "json"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
 
-    payload = {
-        "title": "Режим установлен",
-        "time": utc_now_iso(),
-        "tag": "system",
-        "answer": "Ок. Режим установлен: json",
-        "steps": [],
-        "warnings": [],
-        "need_clarification": False,
-        "clarifying_question": "",
-    }
-    context.user_data["last_payload"] = payload
-    await safe_reply_text(update, json.dumps(payload, ensure_ascii=False, indent=2))
+    now = utc_now_iso()
+    context.user_data["last_payload"] = {**_MODE_JSON_SET_PAYLOAD, "time": now, "steps": [], "warnings": []}
+    await safe_reply_text(update, _MODE_JSON_SET_TEXT.replace(_PAYLOAD_TIME_TOKEN, now, 1))
 
 
 # NEW: summary mode command
@@ -1406,51 +2022,83 @@ async def mode_summary_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
 
     context.user_data["mode"] = MODE_SUMMARY
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
 
     # В summary-режиме память нужна всегда
     context.user_data["memory_enabled"] = True
-    db_set_memory_enabled(chat_id, True)
+    context.user_data.pop("chat_cfg", None)
+    await asyncio.to_thread(db_set_memory_enabled, chat_id, True)
 
     await safe_reply_text(update, "Ок. Режим: summary (сжатие истории: summary вместо полной истории).")
 
 
 async def thinking_model_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["mode"] = "thinking"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
     await safe_reply_text(update, "Ок. Режим установлен: thinking_model (пошаговое решение).")
 
 
 async def expert_group_model_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["mode"] = "experts"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
     await safe_reply_text(update, "Ок. Режим установлен: expert_group_model (Логик/Математик/Ревизор).")
 
 
+# Первые реплики /tz_creation_site и /forest_split одинаковы для всех пользователей:
+# прогреваем их один раз в post_init и дальше отвечаем без запроса к LLM.
+OPENER_MESSAGES = {
+    "tz": [
+        SYS_TZ_MSG,
+        {"role": "user", "content": "Начни. Задай первый вопрос, чтобы собрать требования для ТЗ на создание сайта."},
+    ],
+    "forest": [
+        SYS_FOREST_MSG,
+        {"role": "user", "content": "Начни. Задай первый вопрос для расчёта кто кому сколько должен."},
+    ],
+}
+# Ключ включает модель и температуру: пользователь с другими настройками не получит чужую реплику
+OPENERS: dict[tuple[str, str, float], str] = {}
+OPENERS_MAXSIZE = 64
+
+
+async def get_opener(key: str, temperature: float, model: str | None) -> str:
+    cache_key = (key, model or "", float(temperature))
+    cached = OPENERS.get(cache_key)
+    if cached:
+        return cached
+    first = (await asyncio.to_thread(
+        chat_completion_cached, OPENER_MESSAGES[key], temperature=temperature, model=model
+    ) or "").strip()
+    # ответ уже после strip(): проверка JSON — один символ, без поиска начала
+    if first and first[0] != "{":
+        if len(OPENERS) >= OPENERS_MAXSIZE:
+            OPENERS.pop(next(iter(OPENERS)))
+        OPENERS[cache_key] = first
+    return first
+
+
+async def prewarm_openers() -> None:
+    for key in OPENER_MESSAGES:
+        try:
+            await get_opener(key, DEFAULT_TEMPERATURE, None)
+        except Exception as e:
+            logger.warning(f"Opener prewarm failed for {key}: {e}")
+
+
 async def tz_creation_site_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["mode"] = "tz"
-    context.user_data["tz_history"] = []
+    reset_session(context.user_data)
+    context.user_data["tz_history"] = new_dialog_history()
     context.user_data["tz_questions"] = 0
     context.user_data["tz_done"] = False
-    reset_forest(context)
+    context.user_data["tz_cso"] = ""
 
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
-    temperature = get_temperature(context, chat_id)
-    model = get_model(context, chat_id) or None
+    temperature, model, _ = get_chat_settings(context, chat_id)
 
-    first = (chat_completion(
-        [
-            {"role": "system", "content": SYSTEM_PROMPT_TZ},
-            {"role": "user", "content": "Начни. Задай первый вопрос, чтобы собрать требования для ТЗ на создание сайта."},
-        ],
-        temperature=temperature,
-        model=model,
-    ) or "").strip()
+    first = await get_opener("tz", temperature, model)
 
-    if looks_like_json(first):
+    if first.startswith("{"):
         await send_final_tz_json(update, context, first, temperature=temperature, model=model)
         return
 
@@ -1461,24 +2109,16 @@ async def tz_creation_site_cmd(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def forest_split_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["mode"] = "forest"
-    context.user_data["forest_history"] = []
+    reset_session(context.user_data)
+    context.user_data["forest_history"] = new_dialog_history()
     context.user_data["forest_questions"] = 0
     context.user_data["forest_done"] = False
-    context.user_data.pop("forest_result", None)
-    reset_tz(context)
+    context.user_data["forest_cso"] = ""
 
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
-    temperature = get_temperature(context, chat_id)
-    model = get_model(context, chat_id) or None
+    temperature, model, _ = get_chat_settings(context, chat_id)
 
-    first = (chat_completion(
-        [
-            {"role": "system", "content": SYSTEM_PROMPT_FOREST},
-            {"role": "user", "content": "Начни. Задай первый вопрос для расчёта кто кому сколько должен."},
-        ],
-        temperature=temperature,
-        model=model,
-    ) or "").strip()
+    first = await get_opener("forest", temperature, model)
 
     context.user_data["forest_questions"] = 1
     context.user_data["forest_history"].append({"role": "assistant", "content": first})
@@ -1578,7 +2218,7 @@ async def embed_docs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not update.message:
         return
     
-    await update.message.chat.send_action("typing")
+    send_typing(update)
     
     try:
         # Обрабатываем папку docs/
@@ -1636,8 +2276,7 @@ async def rag_model_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     
     context.user_data["mode"] = "rag"
     context.user_data["rag_submode"] = "rag_filter"  # Режим по умолчанию
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
     
     await safe_reply_text(
         update,
@@ -1710,7 +2349,7 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             context.user_data.pop("waiting_for_readme", None)
             
             # Показываем, что обрабатываем
-            await update.message.chat.send_action("typing")
+            send_typing(update)
             
             # Обрабатываем файл
             result = process_readme_file(
@@ -1784,7 +2423,7 @@ async def on_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     try:
         # Показываем, что обрабатываем
-        await update.message.chat.send_action("typing")
+        send_typing(update)
         
         # Скачиваем аудио
         file = await context.bot.get_file(audio_source.file_id)
@@ -1839,7 +2478,7 @@ async def on_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 {"role": "user", "content": transcribed_text}
             ]
             
-            answer = chat_completion(messages, temperature=0.7, model=OPENROUTER_MODEL, timeout=120)
+            answer = await asyncio.to_thread(chat_completion, messages, temperature=0.7, model=OPENROUTER_MODEL, timeout=120)
             
             if not answer:
                 await safe_reply_text(update, "❌ Модель не вернула ответ. Попробуй ещё раз.")
@@ -1912,7 +2551,7 @@ async def review_pr_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await safe_reply_text(update, f"❌ Номер PR должен быть числом, получено: {context.args[0]}")
         return
     
-    await update.message.chat.send_action("typing")
+    send_typing(update)
     
     # Получаем GitHub token из переменных окружения (пробуем GB_TOKEN, затем GITHUB_TOKEN)
     github_token = os.getenv("GB_TOKEN", "").strip() or os.getenv("GITHUB_TOKEN", "").strip()
@@ -1932,7 +2571,8 @@ async def review_pr_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         # 1. Получаем данные PR через MCP
         await safe_reply_text(update, f"📥 Получаю данные PR #{pr_number}...")
         try:
-            pr_info = await get_pr_info(owner, repo, pr_number, github_token)
+            # info, files и diff запрашиваются параллельно
+            pr_bundle = await get_pr_bundle(owner, repo, pr_number, github_token)
         except ValueError as e:
             error_msg = str(e)
             if "404" in error_msg or "не найден" in error_msg.lower():
@@ -1940,22 +2580,9 @@ async def review_pr_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             elif "401" in error_msg or "Unauthorized" in error_msg:
                 await safe_reply_text(update, f"❌ Ошибка авторизации GitHub.\nПроверьте правильность GB_TOKEN в .env файле.")
             else:
-                await safe_reply_text(update, f"❌ Ошибка при получении информации о PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен (http://127.0.0.1:8000/mcp)\n2. Правильность GB_TOKEN")
-            return
-        
-        try:
-            pr_files = await get_pr_files(owner, repo, pr_number, github_token)
-        except ValueError as e:
-            error_msg = str(e)
-            await safe_reply_text(update, f"❌ Ошибка при получении файлов PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен\n2. Правильность GB_TOKEN\n3. Доступ к репозиторию")
-            return
-        
-        try:
-            pr_diff = await get_pr_diff(owner, repo, pr_number, github_token)
-        except ValueError as e:
-            error_msg = str(e)
-            await safe_reply_text(update, f"❌ Ошибка при получении diff PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен\n2. Правильность GB_TOKEN")
+                await safe_reply_text(update, f"❌ Ошибка при получении данных PR:\n{error_msg}\n\nПроверьте:\n1. MCP сервер запущен (http://127.0.0.1:8000/mcp)\n2. Правильность GB_TOKEN\n3. Доступ к репозиторию")
             return
+        pr_info, pr_files, pr_diff = pr_bundle["info"], pr_bundle["files"], pr_bundle["diff"]
         
         pr_title = pr_info.get("title", "N/A")
         await safe_reply_text(update, f"✅ Получены данные PR: {pr_title}\n📁 Файлов изменено: {len(pr_files)}\n🔍 Ищу релевантную документацию...")
@@ -1969,7 +2596,7 @@ async def review_pr_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         
         # 3. Генерируем ревью через LLM
         messages = create_review_prompt(pr_info, pr_files, pr_diff, rag_context)
-        review_text = chat_completion(messages, temperature=0.3, model=OPENROUTER_MODEL)
+        review_text = await asyncio.to_thread(chat_completion, messages, temperature=0.3, model=OPENROUTER_MODEL)
         
         if not review_text or not review_text.strip():
             await safe_reply_text(update, "❌ LLM вернул пустое ревью.")
@@ -1996,8 +2623,65 @@ async def review_pr_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await safe_reply_text(update, f"❌ Ошибка при анализе PR: {e}")
 
 
+# -------------------- MCP RESPONSE CACHE --------------------
+
+# Погода актуальна несколько минут, новости — чуть дольше: повторные /digest и «Погода <город>»
+# из разных чатов отдаём из памяти, без похода на MCP-сервер.
+WEATHER_CACHE_TTL = 300
+NEWS_CACHE_TTL = 600
+MCP_CACHE_MAXSIZE = 512
+
+# Ответы-ошибки MCP-клиентов (они возвращают текст, а не бросают исключение) не кэшируем
+_MCP_ERROR_PREFIXES = ("Ошибка", "Не удалось", "Город не указан", "Тема новостей не указана")
+
+_WEATHER_CACHE: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+_NEWS_CACHE: "OrderedDict[tuple[str, int], tuple[float, str]]" = OrderedDict()
+# (id кэша, ключ) -> задача запроса «в полёте»
+_MCP_INFLIGHT: dict[tuple, asyncio.Task] = {}
+
+
+async def _cached_mcp_call(cache: OrderedDict, key, ttl: float, fetch) -> str:
+    """Отдаёт ответ из TTL-кэша; одинаковые одновременные запросы ждут один вызов MCP."""
+    value = cache_get(cache, key, ttl)
+    if value is not None:
+        return value
+
+    async def fetch_and_cache() -> str:
+        value = await fetch()
+        if value and not value.startswith(_MCP_ERROR_PREFIXES):
+            cache_put(cache, key, value, MCP_CACHE_MAXSIZE)
+        return value
+
+    return await single_flight(_MCP_INFLIGHT, (id(cache), key), fetch_and_cache)
+
+
+async def cached_weather(city: str) -> str:
+    """Погода через MCP с кэшем на WEATHER_CACHE_TTL секунд (ключ — город в нижнем регистре)."""
+    key = (city or "").strip().lower()
+    return await _cached_mcp_call(_WEATHER_CACHE, key, WEATHER_CACHE_TTL, lambda: get_weather_via_mcp(city))
+
+
+async def cached_news(topic: str, count: int = 5) -> str:
+    """Новости через MCP с кэшем на NEWS_CACHE_TTL секунд (ключ — тема в нижнем регистре и количество)."""
+    key = ((topic or "").strip().lower(), count)
+    return await _cached_mcp_call(_NEWS_CACHE, key, NEWS_CACHE_TTL, lambda: get_news_via_mcp(topic, count=count))
+
+
 # -------------------- DIGEST COMMAND --------------------
 
+# Самарское время (UTC+4) — в нём датируются сводки
+SAMARA_TIMEZONE = timezone(timedelta(hours=4))
+DIGEST_DIR = Path(__file__).resolve().parent / "digests"
+
+
+def _save_digest_file(filename: str, content: bytes) -> None:
+    try:
+        DIGEST_DIR.mkdir(exist_ok=True)
+        (DIGEST_DIR / filename).write_bytes(content)
+    except Exception as e:
+        logger.exception(f"Failed to save digest file: {e}")
+
+
 async def digest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Команда для создания утренней сводки: погода + новости.
@@ -2038,23 +2722,25 @@ async def digest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await safe_reply_text(update, "Город и тема новостей должны быть указаны.")
         return
     
-    await update.message.chat.send_action("typing")
+    send_typing(update)
     
     # Склоняем город в предложный падеж для использования в тексте
     city_prep = _city_prepositional_case(city)
     
-    # Получаем погоду через MCP
-    weather_text = await get_weather_via_mcp(city)
-    
-    # Получаем новости через MCP (5 новостей)
-    news_text = await get_news_via_mcp(news_topic, count=5)
-    
-    # Формируем Markdown файл
-    from datetime import datetime, timedelta, timezone
+    # Погода и новости (5 штук) через MCP — запросы независимые, выполняем параллельно
+    weather_text, news_text = await asyncio.gather(
+        cached_weather(city),
+        cached_news(news_topic, count=5),
+        return_exceptions=True,
+    )
+    if isinstance(weather_text, Exception):
+        logger.warning(f"Digest weather fetch failed for {city}: {weather_text}")
+        weather_text = f"Ошибка при получении погоды: {weather_text}"
+    if isinstance(news_text, Exception):
+        logger.warning(f"Digest news fetch failed for {news_topic}: {news_text}")
+        news_text = f"Ошибка при получении новостей: {news_text}"
     
-    # Самарское время (UTC+4)
-    SAMARA_OFFSET = timedelta(hours=4)
-    SAMARA_TIMEZONE = timezone(SAMARA_OFFSET)
+    # Формируем Markdown файл (время — самарское)
     now = datetime.now(SAMARA_TIMEZONE)
     date_str = now.strftime("%d.%m.%Y %H:%M")
     
@@ -2073,23 +2759,15 @@ async def digest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 *Сгенерировано автоматически*
 """
     
-    # Сохраняем Markdown файл
-    digest_dir = Path(__file__).resolve().parent / "digests"
-    digest_dir.mkdir(exist_ok=True)
+    # Файл пользователю отправляется прямо из памяти; копия на диске (bot/digests) — опционально и в фоне
     filename = f"digest_{chat_id}_{now.strftime('%Y%m%d_%H%M%S')}.md"
-    filepath = digest_dir / filename
-    
-    try:
-        filepath.write_text(markdown_content, encoding="utf-8")
-    except Exception as e:
-        logger.exception(f"Failed to save digest file: {e}")
-        await safe_reply_text(update, f"Ошибка при сохранении файла: {e}")
-        return
+    markdown_bytes = markdown_content.encode("utf-8")
+    if DIGEST_SAVE_FILES:
+        spawn_background(asyncio.to_thread(_save_digest_file, filename, markdown_bytes))
     
     # Формируем текст для ИИ
     mode = MODE_SUMMARY
-    temperature = get_temperature(context, chat_id)
-    model = get_model(context, chat_id) or None
+    temperature, model, _ = get_chat_settings(context, chat_id)
     
     # Создаём промпт для ИИ
     system_prompt = """Ты помощник, который формирует сводку на основе данных о погоде и новостях.
@@ -2109,36 +2787,28 @@ async def digest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     # Получаем ответ от ИИ через mode_summary
     try:
-        messages = build_messages_with_summary(system_prompt, chat_id=chat_id, mode=mode)
+        messages = await asyncio.to_thread(build_messages_cached, build_messages_with_summary, system_prompt, chat_id=chat_id, mode=mode)
         messages.append({"role": "user", "content": user_prompt})
         
-        data = chat_completion_raw(messages, temperature=temperature, model=model)
+        data = await chat_completion_raw_async(messages, temperature=temperature, model=model)
         ai_response = _get_content_from_raw(data)
         
         if not ai_response:
             ai_response = f"Погода: {weather_text}\n\nНовости: {news_text}"
         
-        # Сохраняем в БД
-        db_add_message(chat_id, mode, "user", f"/digest {city}, {news_topic}")
-        db_add_message(chat_id, mode, "assistant", ai_response)
-        
-        # Сжимаем историю
-        try:
-            maybe_compress_history(chat_id, temperature=0.0, mode=mode)
-        except Exception:
-            pass
+        # Сохраняем в БД и сжимаем историю — в фоне
+        persist_turn_background(chat_id, mode, f"/digest {city}, {news_topic}", ai_response)
         
         # Отправляем ответ от ИИ
         await safe_reply_text(update, ai_response)
         
-        # Отправляем Markdown файл
+        # Отправляем Markdown файл — из уже готовых байтов, без повторного чтения с диска
         try:
-            with open(filepath, "rb") as f:
-                await update.message.reply_document(
-                    document=f,
-                    filename=filename,
-                    caption=f"📄 Markdown файл со сводкой: {city}, {news_topic}"
-                )
+            await update.message.reply_document(
+                document=markdown_bytes,
+                filename=filename,
+                caption=f"📄 Markdown файл со сводкой: {city}, {news_topic}"
+            )
         except Exception as e:
             logger.exception(f"Failed to send digest file: {e}")
             await safe_reply_text(update, f"⚠️ Сводка создана, но не удалось отправить файл: {e}")
@@ -2153,31 +2823,24 @@ async def digest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 async def send_final_tz_json(update: Update, context: ContextTypes.DEFAULT_TYPE, raw: str, temperature: float, model: str | None) -> None:
     try:
         json_str = extract_json_object(raw)
-        data = json.loads(json_str)
+        data = loads_json(json_str)
         payload = normalize_payload(data)
     except Exception:
         try:
-            fixed_raw = repair_json_with_model(SYSTEM_PROMPT_TZ, raw, temperature=temperature, model=model)
+            fixed_raw = await asyncio.to_thread(
+                repair_json_with_model, SYSTEM_PROMPT_TZ, raw, temperature=temperature, model=model
+            )
             json_str = extract_json_object(fixed_raw)
-            data = json.loads(json_str)
+            data = loads_json(json_str)
             payload = normalize_payload(data)
         except Exception as e2:
-            err_payload = {
-                "title": "Ошибка",
-                "time": utc_now_iso(),
-                "tag": "error",
-                "answer": "Модель вернула непарсируемый формат для итогового ТЗ.",
-                "steps": [],
-                "warnings": [str(e2)],
-                "need_clarification": False,
-                "clarifying_question": "",
-            }
-            await safe_reply_text(update, json.dumps(err_payload, ensure_ascii=False, indent=2))
+            err_payload = build_error_payload("Модель вернула непарсируемый формат для итогового ТЗ.", e2)
+            await safe_reply_text(update, dumps_payload(err_payload))
             return
 
     context.user_data["tz_done"] = True
     context.user_data["last_payload"] = payload
-    await safe_reply_text(update, json.dumps(payload, ensure_ascii=False, indent=2))
+    await safe_reply_text(update, dumps_payload(payload))
 
 
 async def handle_tz_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, temperature: float, model: str | None) -> None:
@@ -2185,36 +2848,56 @@ async def handle_tz_message(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await safe_reply_text(update, "ТЗ уже сформировано. Если хочешь заново — вызови /tz_creation_site.")
         return
 
-    history = context.user_data.get("tz_history", [])
+    history = get_dialog_history(context.user_data, "tz_history")
     questions_asked = int(context.user_data.get("tz_questions", 0))
-
-    history.append({"role": "user", "content": user_text})
+    cso = context.user_data.get("tz_cso", "")
 
     force_finalize = questions_asked >= 4
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT_TZ}]
-    messages.extend(history)
+    messages = build_cso_messages(SYSTEM_PROMPT_TZ, cso, history, user_text)
+    user_msg = messages[-1]
+    last_question = messages[-2]["content"] if len(messages) > 1 and messages[-2]["role"] == "assistant" else ""
     if force_finalize:
         messages.append({"role": "user", "content": "Сформируй финальное ТЗ прямо сейчас. Верни только JSON по схеме."})
 
     try:
-        raw = (chat_completion(messages, temperature=temperature, model=model) or "").strip()
+        raw = (await asyncio.to_thread(chat_completion_cached, messages, temperature=temperature, model=model) or "").strip()
     except Exception as e:
         await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
         return
 
-    if looks_like_json(raw):
+    if raw.startswith("{"):  # raw уже после strip()
         await send_final_tz_json(update, context, raw, temperature=temperature, model=model)
         return
 
+    # историю пополняем только после успешного ответа модели
+    history.append(user_msg)
     history.append({"role": "assistant", "content": raw})
-    context.user_data["tz_history"] = history
+    trim_dialog_history(history)
     context.user_data["tz_questions"] = questions_asked + 1
     await safe_reply_text(update, raw)
+    context.user_data["tz_cso"] = await asyncio.to_thread(
+        update_context_state, cso, last_question, user_text, model
+    )
 
 
 # -------------------- FOREST FLOW --------------------
 
+def _forest_stream_view(text: str, final: bool) -> str | None:
+    """
+    Показ ответа леса при стриминге: первая строка может быть маркером FINAL,
+    поэтому до её завершения ничего не показываем, а сам маркер вырезаем.
+    """
+    if not final and "\n" not in text:
+        return None
+    if is_forest_final(text):
+        report = strip_forest_final_marker(text)
+        if not report and final:
+            return "Ошибка: финал без отчёта. Запусти /forest_split заново."
+        return report or None
+    return text
+
+
 async def handle_forest_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, temperature: float, model: str | None) -> None:
     if context.user_data.get("forest_done"):
         if user_asked_to_show_result(user_text):
@@ -2227,52 +2910,121 @@ async def handle_forest_message(update: Update, context: ContextTypes.DEFAULT_TY
         await safe_reply_text(update, "Расчёт уже готов. Если хочешь заново — вызови /forest_split.")
         return
 
-    history = context.user_data.get("forest_history", [])
+    history = get_dialog_history(context.user_data, "forest_history")
     questions_asked = int(context.user_data.get("forest_questions", 0))
-
-    history.append({"role": "user", "content": user_text})
+    cso = context.user_data.get("forest_cso", "")
 
     force_finalize = questions_asked >= 6
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT_FOREST}]
-    messages.extend(history)
+    messages = build_cso_messages(SYSTEM_PROMPT_FOREST, cso, history, user_text)
+    user_msg = messages[-1]
+    last_question = messages[-2]["content"] if len(messages) > 1 and messages[-2]["role"] == "assistant" else ""
     if force_finalize:
         messages.append({
             "role": "user",
             "content": "Хватит вопросов. Сформируй финальный отчёт прямо сейчас. Первая строка FINAL, далее отчёт текстом."
         })
 
+    # ответ стримится; показ отрисовывает _forest_stream_view (маркер FINAL пользователю не виден)
     try:
-        raw = (chat_completion(messages, temperature=temperature, model=model) or "").strip()
+        raw, stream_error = await stream_reply_text(
+            update, messages, temperature=temperature, model=model, view=_forest_stream_view
+        )
     except Exception as e:
         await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
         return
 
-    if not raw:
-        await safe_reply_text(update, "Пустой ответ от модели.")
+    # пустой или оборванный ответ уже показан с пометкой — состояние сценария не меняем
+    if not raw or stream_error is not None:
         return
 
+    # историю пополняем только после непустого ответа модели
+    history.append(user_msg)
+
     if is_forest_final(raw):
         report = strip_forest_final_marker(raw)
         if not report:
-            await safe_reply_text(update, "Ошибка: финал без отчёта. Запусти /forest_split заново.")
             return
 
         context.user_data["forest_done"] = True
         context.user_data["forest_result"] = report
         history.append({"role": "assistant", "content": raw})
-        context.user_data["forest_history"] = history
-        await safe_reply_text(update, report)
         return
 
     history.append({"role": "assistant", "content": raw})
-    context.user_data["forest_history"] = history
+    trim_dialog_history(history)
     context.user_data["forest_questions"] = questions_asked + 1
-    await safe_reply_text(update, raw)
+    context.user_data["forest_cso"] = await asyncio.to_thread(
+        update_context_state, cso, last_question, user_text, model
+    )
 
 
 # -------------------- MAIN TEXT HANDLER --------------------
 
+# Шаблоны команд, которые on_text проверяет на каждом сообщении — компилируем один раз
+_PROFILE_UPDATE_RE = re.compile(r"^обновить\s+профиль\s+(.+)$", re.IGNORECASE)
+_RAG_FILTER_RE = re.compile(r"^rag\+?фильтр(?:\s+(.+))?$", re.IGNORECASE)
+_RAG_NO_FILTER_RE = re.compile(r"^rag\s+без\s+фильтра(?:\s+(.+))?$", re.IGNORECASE)
+_NO_RAG_RE = re.compile(r"^без\s+rag(?:\s+(.+))?$", re.IGNORECASE)
+_SITE_UP_RE = re.compile(r"^(?:подними|поднять|запусти|запустить)\s+сайт$", re.IGNORECASE)
+_SCREENSHOT_RE = re.compile(r"^(?:сделай|создай|снять)\s+скрин(?:шот)?$", re.IGNORECASE)
+_SITE_DOWN_RE = re.compile(r"^(?:останови|остановить|выключи|выключить)\s+сайт$", re.IGNORECASE)
+_WEATHER_RE = re.compile(r"^(?:погода|weather)\s+(.+)$", re.IGNORECASE)
+
+
+# -------------------- SUMMARY MODE COMMANDS --------------------
+# Каждая команда сама отвечает пользователю и возвращает текст ответа ассистента для истории.
+
+async def _summary_site_up(update: Update) -> str:
+    result = await site_up_via_mcp()
+    await safe_reply_text(update, result)
+    return result
+
+
+async def _summary_site_down(update: Update) -> str:
+    result = await site_down_via_mcp()
+    await safe_reply_text(update, result)
+    return result
+
+
+async def _summary_screenshot(update: Update) -> str | None:
+    screenshot_path = await site_screenshot_via_mcp()
+
+    # Если файл не найден, MCP вернул текст ошибки — отправляем его как есть
+    if not (screenshot_path and Path(screenshot_path).exists()):
+        await safe_reply_text(update, screenshot_path)
+        return screenshot_path
+
+    try:
+        # Отправляем PNG файл в Telegram
+        with open(screenshot_path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename="site.png",
+                caption="📸 Скриншот сайта"
+            )
+    except Exception as e:
+        logger.exception(f"Failed to send screenshot: {e}")
+        await safe_reply_text(update, f"Скриншот создан, но не удалось отправить: {e}")
+        return None  # в историю попадёт только запрос
+    return f"Скриншот создан: {screenshot_path}"
+
+
+_SUMMARY_COMMANDS = (
+    (_SITE_UP_RE, _summary_site_up),
+    (_SCREENSHOT_RE, _summary_screenshot),
+    (_SITE_DOWN_RE, _summary_site_down),
+)
+
+
+async def _run_summary_command(update: Update, chat_id: int, text: str, command) -> None:
+    """Общая обвязка команд summary-режима: «печатает», выполнение, запись хода в историю."""
+    send_typing(update)
+    answer = await command(update)
+    # Сохраняем запрос и ответ в БД, сжимаем историю — в фоне
+    persist_turn_background(chat_id, MODE_SUMMARY, text, answer or "")
+
+
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
@@ -2285,13 +3037,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if await tokens_test_intercept(update, context, text):
         return
 
-    await update.message.chat.send_action("typing")
+    send_typing(update)
 
     mode = get_mode(context)
     chat_id = int(update.effective_chat.id) if update.effective_chat else 0
-    temperature = get_temperature(context, chat_id)
-    memory_enabled = get_memory_enabled(context, chat_id)
-    model = get_model(context, chat_id) or None
+    temperature, model, memory_enabled = get_chat_settings(context, chat_id)
 
     # ---- VOICE MODE ----
     if mode == "voice":
@@ -2376,10 +3126,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Сбросить настройки к значениям по умолчанию
         if "сбросить настройки модели" in text_lower or "сбросить настройки" in text_lower:
             # Удаляем пользовательские настройки
-            context.user_data.pop("ollama_temperature", None)
-            context.user_data.pop("ollama_num_ctx", None)
-            context.user_data.pop("ollama_num_predict", None)
-            context.user_data.pop("ollama_system_prompt", None)
+            reset_session(context.user_data, OLLAMA_SETTINGS_KEYS)
             settings_text = _get_ollama_settings_display(context.user_data)
             await safe_reply_text(update, f"✅ Настройки сброшены к значениям по умолчанию:\n\n{settings_text}")
             return
@@ -2424,7 +3171,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         text_lower = text.lower().strip()
         
         # Команда "Обновить профиль [текст]"
-        update_profile_match = re.match(r'^обновить\s+профиль\s+(.+)$', text, re.IGNORECASE)
+        update_profile_match = _PROFILE_UPDATE_RE.match(text)
         if update_profile_match:
             update_text = update_profile_match.group(1).strip()
             if not update_text:
@@ -2433,8 +3180,8 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             
             try:
                 await safe_reply_text(update, "⏳ Обновляю профиль...")
-                updated_profile = update_profile_from_text(update_text)
-                save_user_profile(updated_profile)
+                updated_profile = await asyncio.to_thread(update_profile_from_text, update_text)
+                await asyncio.to_thread(save_user_profile, updated_profile)
                 await safe_reply_text(update, "✅ Профиль успешно обновлен!")
             except ValueError as e:
                 await safe_reply_text(update, f"❌ {str(e)}")
@@ -2496,7 +3243,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.debug(f"ME mode: sending request to model {ME_MODEL}, messages count: {len(messages)}")
             
             # Отправляем запрос в OpenRouter
-            answer = chat_completion(messages, temperature=temperature, model=ME_MODEL)
+            answer = await asyncio.to_thread(chat_completion, messages, temperature=temperature, model=ME_MODEL)
             
             if not answer:
                 await safe_reply_text(update, "❌ Модель не вернула ответ. Попробуйте еще раз.")
@@ -2533,21 +3280,21 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         new_submode = None
         
         # Проверяем "RAG+фильтр" или "RAG фильтр"
-        rag_filter_match = re.match(r"^rag\+?фильтр(?:\s+(.+))?$", text, re.IGNORECASE)
+        rag_filter_match = _RAG_FILTER_RE.match(text)
         if rag_filter_match:
             new_submode = "rag_filter"
             question_text = rag_filter_match.group(1).strip() if rag_filter_match.group(1) else None
         
         # Проверяем "RAG без фильтра"
         if not new_submode:
-            rag_no_filter_match = re.match(r"^rag\s+без\s+фильтра(?:\s+(.+))?$", text, re.IGNORECASE)
+            rag_no_filter_match = _RAG_NO_FILTER_RE.match(text)
             if rag_no_filter_match:
                 new_submode = "rag_no_filter"
                 question_text = rag_no_filter_match.group(1).strip() if rag_no_filter_match.group(1) else None
         
         # Проверяем "Без RAG"
         if not new_submode:
-            no_rag_match = re.match(r"^без\s+rag(?:\s+(.+))?$", text, re.IGNORECASE)
+            no_rag_match = _NO_RAG_RE.match(text)
             if no_rag_match:
                 new_submode = "no_rag"
                 question_text = no_rag_match.group(1).strip() if no_rag_match.group(1) else None
@@ -2634,7 +3381,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             # Формируем сообщения для LLM
             system_prompt = SYSTEM_PROMPT_TEXT
             if memory_enabled:
-                messages = build_messages_with_db_memory(system_prompt, chat_id=chat_id)
+                messages = await asyncio.to_thread(build_messages_cached, build_messages_with_db_memory, system_prompt, chat_id=chat_id)
             else:
                 messages = [{"role": "system", "content": system_prompt}]
             
@@ -2642,15 +3389,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             
             # Отправляем запрос к LLM
             try:
-                answer = chat_completion(messages, temperature=temperature, model=model)
+                answer = await asyncio.to_thread(chat_completion, messages, temperature=temperature, model=model)
                 answer = (answer or "").strip() or "Пустой ответ от модели."
             except Exception as e:
                 await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
                 return
             
-            # Сохраняем в БД
-            db_add_message(chat_id, mode, "user", text)
-            db_add_message(chat_id, mode, "assistant", answer)
+            # Сохраняем в БД — в фоне, ответ не ждёт записи
+            persist_turn_background(chat_id, mode, text, answer, compress=False)
             
             await safe_reply_text(update, answer)
             return
@@ -2702,7 +3448,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             # Формируем сообщения для LLM
             system_prompt = SYSTEM_PROMPT_TEXT
             if memory_enabled:
-                messages = build_messages_with_db_memory(system_prompt, chat_id=chat_id)
+                messages = await asyncio.to_thread(build_messages_cached, build_messages_with_db_memory, system_prompt, chat_id=chat_id)
             else:
                 messages = [{"role": "system", "content": system_prompt}]
             
@@ -2710,15 +3456,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             
             # Отправляем запрос к LLM
             try:
-                answer = chat_completion(messages, temperature=temperature, model=model)
+                answer = await asyncio.to_thread(chat_completion, messages, temperature=temperature, model=model)
                 answer = (answer or "").strip() or "Пустой ответ от модели."
             except Exception as e:
                 await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
                 return
             
-            # Сохраняем в БД
-            db_add_message(chat_id, mode, "user", text)
-            db_add_message(chat_id, mode, "assistant", answer)
+            # Сохраняем в БД — в фоне, ответ не ждёт записи
+            persist_turn_background(chat_id, mode, text, answer, compress=False)
             
             await safe_reply_text(update, answer)
             return
@@ -2727,7 +3472,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             # Режим Без RAG - обычный ответ без поиска
             system_prompt = SYSTEM_PROMPT_TEXT
             if memory_enabled:
-                messages = build_messages_with_db_memory(system_prompt, chat_id=chat_id)
+                messages = await asyncio.to_thread(build_messages_cached, build_messages_with_db_memory, system_prompt, chat_id=chat_id)
             else:
                 messages = [{"role": "system", "content": system_prompt}]
             
@@ -2735,107 +3480,39 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             
             # Отправляем запрос к LLM
             try:
-                answer = chat_completion(messages, temperature=temperature, model=model)
+                answer = await asyncio.to_thread(chat_completion, messages, temperature=temperature, model=model)
                 answer = (answer or "").strip() or "Пустой ответ от модели."
             except Exception as e:
                 await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
                 return
             
-            # Сохраняем в БД
-            db_add_message(chat_id, mode, "user", text)
-            db_add_message(chat_id, mode, "assistant", answer)
+            # Сохраняем в БД — в фоне, ответ не ждёт записи
+            persist_turn_background(chat_id, mode, text, answer, compress=False)
             
             await safe_reply_text(update, answer)
         return
 
     # ---- CHAT MODES (text/thinking/experts/summary) ----
     if mode in ("text", "thinking", "experts", MODE_SUMMARY):
-        # Проверка на команды управления сайтом в режиме summary
+        # Команды управления сайтом в режиме summary
         if mode == MODE_SUMMARY:
-            # Команда "Подними сайт"
-            if re.match(r"^(?:подними|поднять|запусти|запустить)\s+сайт$", text, re.IGNORECASE):
-                await update.message.chat.send_action("typing")
-                result = await site_up_via_mcp()
-                # Сохраняем запрос и ответ в БД
-                db_add_message(chat_id, mode, "user", text)
-                db_add_message(chat_id, mode, "assistant", result)
-                # Сжимаем историю
-                try:
-                    maybe_compress_history(chat_id, temperature=0.0, mode=MODE_SUMMARY)
-                except Exception:
-                    pass
-                await safe_reply_text(update, result)
-                return
-            
-            # Команда "Сделай скрин" или "Сделай скриншот"
-            if re.match(r"^(?:сделай|создай|снять)\s+скрин(?:шот)?$", text, re.IGNORECASE):
-                await update.message.chat.send_action("typing")
-                screenshot_path = await site_screenshot_via_mcp()
-                
-                # Сохраняем запрос в БД
-                db_add_message(chat_id, mode, "user", text)
-                
-                # Проверяем, что путь к файлу получен
-                if screenshot_path and Path(screenshot_path).exists():
-                    try:
-                        # Отправляем PNG файл в Telegram
-                        with open(screenshot_path, "rb") as f:
-                            await update.message.reply_document(
-                                document=f,
-                                filename="site.png",
-                                caption="📸 Скриншот сайта"
-                            )
-                        # Сохраняем ответ в БД
-                        db_add_message(chat_id, mode, "assistant", f"Скриншот создан: {screenshot_path}")
-                    except Exception as e:
-                        logger.exception(f"Failed to send screenshot: {e}")
-                        await safe_reply_text(update, f"Скриншот создан, но не удалось отправить: {e}")
-                else:
-                    # Если файл не найден, отправляем текстовый ответ
-                    db_add_message(chat_id, mode, "assistant", screenshot_path)
-                    await safe_reply_text(update, screenshot_path)
-                
-                # Сжимаем историю
-                try:
-                    maybe_compress_history(chat_id, temperature=0.0, mode=MODE_SUMMARY)
-                except Exception:
-                    pass
-                return
-            
-            # Команда "Останови сайт"
-            if re.match(r"^(?:останови|остановить|выключи|выключить)\s+сайт$", text, re.IGNORECASE):
-                await update.message.chat.send_action("typing")
-                result = await site_down_via_mcp()
-                # Сохраняем запрос и ответ в БД
-                db_add_message(chat_id, mode, "user", text)
-                db_add_message(chat_id, mode, "assistant", result)
-                # Сжимаем историю
-                try:
-                    maybe_compress_history(chat_id, temperature=0.0, mode=MODE_SUMMARY)
-                except Exception:
-                    pass
-                await safe_reply_text(update, result)
-                return
+            for pattern, command in _SUMMARY_COMMANDS:
+                if pattern.match(text):
+                    await _run_summary_command(update, chat_id, text, command)
+                    return
         
         # Проверка на запрос погоды в режиме summary (например: "Погода Москва" или "Погода Самара")
         weather_request_handled = False
         if mode == MODE_SUMMARY:
             # Паттерн: "Погода" + название города (может быть на русском или английском)
-            weather_match = re.match(r"^(?:погода|weather)\s+(.+)$", text, re.IGNORECASE)
+            weather_match = _WEATHER_RE.match(text)
             if weather_match:
                 city = weather_match.group(1).strip()
                 if city:
                     # Получаем погоду через MCP и возвращаем результат
-                    weather_text = await get_weather_via_mcp(city)
-                    # Сохраняем запрос и ответ в БД для истории
-                    db_add_message(chat_id, mode, "user", text)
-                    db_add_message(chat_id, mode, "assistant", weather_text)
-                    
-                    # Вызываем сжатие истории (как для обычных сообщений)
-                    try:
-                        maybe_compress_history(chat_id, temperature=0.0, mode=MODE_SUMMARY)
-                    except Exception:
-                        pass
+                    weather_text = await cached_weather(city)
+                    # Сохраняем запрос и ответ в БД для истории и сжимаем её (как для обычных сообщений) — в фоне
+                    persist_turn_background(chat_id, mode, text, weather_text)
                     
                     # Отправляем ответ с погодой
                     await safe_reply_text(update, weather_text)
@@ -2852,18 +3529,20 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if memory_enabled:
             # NEW: summary-context builder
             if mode == MODE_SUMMARY:
-                messages = build_messages_with_summary(system_prompt, chat_id=chat_id, mode=MODE_SUMMARY)
+                messages = await asyncio.to_thread(
+                    build_messages_cached, build_messages_with_summary, system_prompt, chat_id=chat_id, mode=MODE_SUMMARY
+                )
             else:
-                messages = build_messages_with_db_memory(system_prompt, chat_id=chat_id)
+                messages = await asyncio.to_thread(build_messages_cached, build_messages_with_db_memory, system_prompt, chat_id=chat_id)
         else:
-            messages = [{"role": "system", "content": system_prompt}]  # без истории
+            messages = [system_message(system_prompt)]  # без истории
 
         messages.append({"role": "user", "content": text})
 
         # SUMMARY: нужен raw, чтобы взять usage
         if mode == MODE_SUMMARY:
             try:
-                data = chat_completion_raw(messages, temperature=temperature, model=model)
+                data = await chat_completion_raw_async(messages, temperature=temperature, model=model)
                 answer = _get_content_from_raw(data)
                 pt, ct, tt = _get_usage_tokens(data)
                 req_id = str(data.get("id") or "").strip()
@@ -2873,48 +3552,37 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
             answer = (answer or "").strip() or "Пустой ответ от модели."
 
-            # пишем в БД (summary всегда с памятью)
-            db_add_message(chat_id, mode, "user", text)
-            db_add_message(chat_id, mode, "assistant", answer)
+            # пишем в БД (summary всегда с памятью) и сжимаем историю — в фоне, ответ не ждёт
+            persist_turn_background(chat_id, mode, text, answer)
 
-            try:
-                maybe_compress_history(chat_id, temperature=0.0, mode=MODE_SUMMARY)
-            except Exception:
-                pass
-
-            # 1) ответ
-            def fmt(x: int | None) -> str:
-                return str(x) if isinstance(x, int) else "n/a"
-
-            rid = f", id={req_id}" if req_id else ""
-            combined = f"{answer}\n\nТокены: запрос={fmt(pt)}, ответ={fmt(ct)}, всего={fmt(tt)}{rid}"
-            await safe_reply_text(update, combined)
+            # ответ и расход токенов — одним сообщением
+            await safe_reply_text(update, f"{answer}\n\n{_format_usage_line(pt, ct, tt, req_id)}")
             return
 
 
-        # НЕ summary — как было
+        # НЕ summary — ответ стримится в одно сообщение
         try:
-            answer = (chat_completion(messages, temperature=temperature, model=model) or "").strip()
+            answer, stream_error = await stream_reply_text(update, messages, temperature=temperature, model=model)
         except Exception as e:
             await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
             return
+        if stream_error is not None:
+            return  # оборванный ответ показан с пометкой, в историю его не пишем
 
         answer = answer or "Пустой ответ от модели."
 
         # пишем в БД только если память включена
         if memory_enabled:
-            db_add_message(chat_id, mode, "user", text)
-            db_add_message(chat_id, mode, "assistant", answer)
-
-        await safe_reply_text(update, answer)
+            persist_turn_background(chat_id, mode, text, answer, compress=False)
         return
 
     # ---- JSON MODE (без памяти) ----
     raw = ""
     try:
-        raw = chat_completion(
+        raw = await asyncio.to_thread(
+            chat_completion,
             [
-                {"role": "system", "content": SYSTEM_PROMPT_JSON},
+                SYS_JSON_MSG,
                 {"role": "user", "content": text},
             ],
             temperature=temperature,
@@ -2922,31 +3590,24 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         ) or ""
 
         json_str = extract_json_object(raw)
-        data = json.loads(json_str)
+        data = loads_json(json_str)
         payload = normalize_payload(data)
 
     except Exception:
         try:
-            fixed_raw = repair_json_with_model(SYSTEM_PROMPT_JSON, raw or text, temperature=temperature, model=model)
+            fixed_raw = await asyncio.to_thread(
+                repair_json_with_model, SYSTEM_PROMPT_JSON, raw or text, temperature=temperature, model=model
+            )
             json_str = extract_json_object(fixed_raw)
-            data = json.loads(json_str)
+            data = loads_json(json_str)
             payload = normalize_payload(data)
         except Exception as e2:
-            err_payload = {
-                "title": "Ошибка",
-                "time": utc_now_iso(),
-                "tag": "error",
-                "answer": "Модель вернула непарсируемый формат.",
-                "steps": [],
-                "warnings": [str(e2)],
-                "need_clarification": False,
-                "clarifying_question": "",
-            }
-            await safe_reply_text(update, json.dumps(err_payload, ensure_ascii=False, indent=2))
+            err_payload = build_error_payload("Модель вернула непарсируемый формат.", e2)
+            await safe_reply_text(update, dumps_payload(err_payload))
             return
 
     context.user_data["last_payload"] = payload
-    await safe_reply_text(update, json.dumps(payload, ensure_ascii=False, indent=2))
+    await safe_reply_text(update, dumps_payload(payload))
 
 
 # -------------------- GOOGLE SHEETS COMMANDS --------------------
@@ -3133,23 +3794,12 @@ async def support_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
     
     try:
-        # Получаем данные пользователя через MCP
-        user_data = None
-        try:
-            user_data = await user_get(username)
-        except ValueError as e:
-            logger.warning(f"Could not get user data: {e}")
-        
-        # Получаем активные записи через MCP
-        active_regs = []
-        try:
-            active_regs = await reg_find_by_user(username) or []
-            if active_regs:
-                logger.info(f"Found {len(active_regs)} active registrations for user {username}: {active_regs}")
-            else:
-                logger.info(f"No active registrations found for user {username}")
-        except ValueError as e:
-            logger.warning(f"Could not get user registrations: {e}")
+        # Данные пользователя и активные записи через MCP (параллельно)
+        user_data, active_regs = await fetch_user_context(username)
+        if active_regs:
+            logger.info(f"Found {len(active_regs)} active registrations for user {username}: {active_regs}")
+        else:
+            logger.info(f"No active registrations found for user {username}")
         
         # RAG поиск
         rag_chunks = []
@@ -3226,7 +3876,7 @@ async def support_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         
         # Отправляем запрос к LLM
         try:
-            answer = chat_completion(messages, temperature=0.7, model=OPENROUTER_MODEL)
+            answer = await asyncio.to_thread(chat_completion, messages, temperature=0.7, model=OPENROUTER_MODEL)
             answer = (answer or "").strip() or "Пустой ответ от модели."
         except Exception as e:
             await safe_reply_text(update, f"Ошибка запроса к LLM: {e}")
@@ -3295,8 +3945,7 @@ async def task_list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
     
     context.user_data["mode"] = "task_list"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
     
     welcome_text = """✅ Режим работы с задачами активирован!
 
@@ -3430,21 +4079,6 @@ async def deploy_bot_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
       - ./digests:/app/bot/digests
     user: "0:0"
 """
-        await safe_reply_text(update, "📝 Создаю docker-compose.yml...")
-        compose_result = await deploy_create_compose(
-            deploy_ssh_host, deploy_ssh_port, deploy_ssh_username, deploy_ssh_password,
-            compose_content, compose_path
-        )
-        if not compose_result or compose_result.get("status") != "success":
-            error_msg = compose_result.get("message", "Неизвестная ошибка") if compose_result else "Ошибка при создании docker-compose.yml"
-            await safe_reply_text(update, f"❌ Ошибка при создании docker-compose.yml: {error_msg}")
-            return
-        compose_msg = compose_result.get('message', 'docker-compose.yml создан')
-        if compose_result.get('skipped'):
-            await safe_reply_text(update, f"⏭️ {compose_msg}")
-        else:
-            await safe_reply_text(update, f"✅ {compose_msg}")
-        
         # 5. Создание .env файла с данными тестового бота
         env_path = f"{deploy_remote_path}/.env"
         env_content = f"""TELEGRAM_BOT_TOKEN={deploy_bot_token}
@@ -3461,11 +4095,22 @@ OLLAMA_NUM_CTX={deploy_ollama_num_ctx}
 OLLAMA_NUM_PREDICT={deploy_ollama_num_predict}
 OLLAMA_SYSTEM_PROMPT={deploy_ollama_system_prompt}
 """
-        await safe_reply_text(update, "📝 Проверяю .env файл...")
-        env_result = await deploy_create_env(
+        await safe_reply_text(update, "📝 Создаю docker-compose.yml и проверяю .env файл...")
+        # Файлы независимы — создаём их параллельно
+        compose_result, env_result = await deploy_prepare_files(
             deploy_ssh_host, deploy_ssh_port, deploy_ssh_username, deploy_ssh_password,
-            env_content, env_path
+            compose_content, env_content, compose_path, env_path
         )
+        if not compose_result or compose_result.get("status") != "success":
+            error_msg = compose_result.get("message", "Неизвестная ошибка") if compose_result else "Ошибка при создании docker-compose.yml"
+            await safe_reply_text(update, f"❌ Ошибка при создании docker-compose.yml: {error_msg}")
+            return
+        compose_msg = compose_result.get('message', 'docker-compose.yml создан')
+        if compose_result.get('skipped'):
+            await safe_reply_text(update, f"⏭️ {compose_msg}")
+        else:
+            await safe_reply_text(update, f"✅ {compose_msg}")
+        
         if not env_result or env_result.get("status") != "success":
             error_msg = env_result.get("message", "Неизвестная ошибка") if env_result else "Ошибка при создании .env файла"
             await safe_reply_text(update, f"❌ Ошибка при создании .env файла: {error_msg}")
@@ -3488,7 +4133,6 @@ OLLAMA_SYSTEM_PROMPT={deploy_ollama_system_prompt}
             return
         
         # Ждем немного, чтобы контейнер успел запуститься
-        import asyncio
         await asyncio.sleep(3)
         
         # Проверяем статус контейнера и логи
@@ -3718,7 +4362,7 @@ async def handle_task_list_message(update: Update, context: ContextTypes.DEFAULT
         
         # Парсинг намерения
         try:
-            intent_response = chat_completion(messages, temperature=0.3, model=model)
+            intent_response = await asyncio.to_thread(chat_completion, messages, temperature=0.3, model=model)
             intent_response = (intent_response or "").strip()
             
             # Извлекаем JSON из ответа
@@ -3903,7 +4547,7 @@ async def handle_task_list_message(update: Update, context: ContextTypes.DEFAULT
                     {"role": "user", "content": recommendation_prompt}
                 ]
                 
-                recommendation = chat_completion(rec_messages, temperature=0.7, model=model)
+                recommendation = await asyncio.to_thread(chat_completion, rec_messages, temperature=0.7, model=model)
                 recommendation = (recommendation or "").strip()
                 
                 response_parts = [recommendation]
@@ -4191,8 +4835,7 @@ async def local_model_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not context.args:
         chat_id = int(update.effective_chat.id) if update.effective_chat else 0
         context.user_data["mode"] = "local_model"
-        reset_tz(context)
-        reset_forest(context)
+        reset_session(context.user_data)
         
         settings_text = _get_ollama_settings_display(context.user_data)
         
@@ -4270,10 +4913,7 @@ async def local_model_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Сбросить настройки к значениям по умолчанию
     if "сбросить настройки модели" in text or "сбросить настройки" in text:
         # Удаляем пользовательские настройки
-        context.user_data.pop("ollama_temperature", None)
-        context.user_data.pop("ollama_num_ctx", None)
-        context.user_data.pop("ollama_num_predict", None)
-        context.user_data.pop("ollama_system_prompt", None)
+        reset_session(context.user_data, OLLAMA_SETTINGS_KEYS)
         settings_text = _get_ollama_settings_display(context.user_data)
         await safe_reply_text(update, f"✅ Настройки сброшены к значениям по умолчанию:\n\n{settings_text}")
         return
@@ -4317,8 +4957,7 @@ async def me_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     # Переключаем режим на "me"
     context.user_data["mode"] = "me"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
     
     # Загружаем профиль для проверки
     try:
@@ -4351,8 +4990,7 @@ async def voice_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     # Переключаем режим на "voice"
     context.user_data["mode"] = "voice"
-    reset_tz(context)
-    reset_forest(context)
+    reset_session(context.user_data)
     
     await safe_reply_text(
         update,
@@ -4382,13 +5020,14 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # -------------------- BOT COMMANDS MENU --------------------
 
-async def post_init(app: Application) -> None:
+def _build_bot_commands() -> tuple[BotCommand, ...]:
+    model_name = _short_model_name(OPENROUTER_MODEL)
     cmds = [
         BotCommand("start", "Старт"),
         BotCommand("help", "Справка"),
-        BotCommand("mode_text", f"Режим text + {_short_model_name(OPENROUTER_MODEL)}"),
+        BotCommand("mode_text", f"Режим text + {model_name}"),
         BotCommand("mode_json", "JSON на каждое сообщение"),
-        BotCommand("mode_summary", f"Режим summary + {_short_model_name(OPENROUTER_MODEL)}"),
+        BotCommand("mode_summary", f"Режим summary + {model_name}"),
         BotCommand("summary_debug", "Показать текущее summary (режим summary)"),
         BotCommand("tz_creation_site", "Собрать ТЗ на сайт (итог JSON)"),
         BotCommand("forest_split", "Кто кому должен (итог текст)"),
@@ -4430,7 +5069,82 @@ async def post_init(app: Application) -> None:
     if MODEL_GEMMA:
         cmds.append(BotCommand("model_gemma", f"Модель: {_short_model_name(MODEL_GEMMA)}"))
 
-    await app.bot.set_my_commands(cmds)
+    return tuple(cmds)
+
+
+# Список команд меню не меняется за время работы — собираем один раз при импорте
+_BOT_COMMANDS = _build_bot_commands()
+
+
+async def post_init(app: Application) -> None:
+    await app.bot.set_my_commands(_BOT_COMMANDS)
+
+    # прогрев стартовых реплик ТЗ/леса — в фоне, чтобы не задерживать запуск
+    spawn_background(prewarm_openers())
+    # ссылку держим, чтобы остановить цикл в post_shutdown до закрытия БД
+    app.bot_data["wal_checkpoint_task"] = spawn_background(wal_checkpoint_loop())
+
+
+async def post_shutdown(app: Application) -> None:
+    # останавливаем фоновый checkpoint WAL до закрытия соединения с БД
+    task = app.bot_data.pop("wal_checkpoint_task", None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    close_db()
+
+    # закрываем пулы keep-alive соединений к OpenRouter и общую MCP-сессию
+    close_http_session()
+    await close_async_client()
+    await close_mcp_session()
+
+
+try:
+    import h2  # noqa: F401  — нужен httpx для HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Таймаут long polling для getUpdates (секунды)
+POLLING_TIMEOUT = 30.0
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Разные чаты обрабатываются параллельно, апдейты одного чата — строго по очереди.
+    Хендлеры регистрируются блокирующими, иначе PTB отпустит апдейт сразу после
+    создания задачи и порядок внутри чата снова потеряется.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 256) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks = KeyedLocks()
+
+    @staticmethod
+    def _key(update: object) -> int | None:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+        async with self._locks.hold(key):
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
 
 
 def run() -> None:
@@ -4440,24 +5154,53 @@ def run() -> None:
     # Use new database initialization
     init_db()
     # Инициализируем таблицу для эмбеддингов
-    from .embeddings import init_embeddings_table
     init_embeddings_table()
 
+    # Пул соединений побольше: ответы в разные чаты уходят параллельно
+    # и не должны ждать свободного соединения. HTTP/2 (мультиплексирование запросов в одном
+    # соединении) — только если установлен пакет h2, его нет в обязательных зависимостях.
     request = HTTPXRequest(
+        connection_pool_size=256,
+        http_version="2" if HTTP2_AVAILABLE else "1.1",
         connect_timeout=20.0,
         read_timeout=60.0,
         write_timeout=60.0,
         pool_timeout=20.0,
     )
+    # getUpdates — отдельный клиент, чтобы long polling не занимал соединение из общего пула.
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=1,
+        connect_timeout=20.0,
+        read_timeout=POLLING_TIMEOUT + 10.0,
+        write_timeout=20.0,
+        pool_timeout=20.0,
+    )
 
-    app = (
+    builder = (
         Application.builder()
         .token(TELEGRAM_BOT_TOKEN)
         .request(request)
+        .get_updates_request(get_updates_request)
+        # Апдейты из пачки getUpdates обрабатываются параллельно по чатам,
+        # а внутри одного чата — в порядке поступления (см. PerChatUpdateProcessor).
+        .concurrent_updates(PerChatUpdateProcessor())
         .post_init(post_init)
-        .build()
+        .post_shutdown(post_shutdown)
     )
 
+    # Персистентность user_data/chat_data: сессии ТЗ/леса и режимы не теряются при перезапуске.
+    # bot_data не сохраняем — там лежат функции (tokens_deps) и asyncio-задачи подписок.
+    if BOT_PERSISTENCE_PATH:
+        builder = builder.persistence(
+            PicklePersistence(
+                filepath=BOT_PERSISTENCE_PATH,
+                store_data=PersistenceInput(bot_data=False, callback_data=False),
+                update_interval=30,
+            )
+        )
+
+    app = builder.build()
+
     # deps для tokens_test.py (чтобы не дублировать логику)
     app.bot_data["tokens_deps"] = {
         "get_temperature": get_temperature,
@@ -4468,7 +5211,7 @@ def run() -> None:
     }
 
     # Use new error handler
-    app.add_error_handler(handle_error)
+    app.add_error_handler(handle_error, block=False)
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -4521,7 +5264,29 @@ def run() -> None:
     app.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, on_voice))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
 
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        # Webhook: каждый апдейт приходит отдельным POST, без цикла getUpdates.
+        # Путь и секрет по умолчанию случайные — адрес нельзя угадать, чужие POST отклоняются.
+        url_path = WEBHOOK_PATH or secrets.token_urlsafe(24)
+        logger.info(f"Starting webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=url_path,
+            webhook_url=f"{WEBHOOK_URL}/{url_path}",
+            secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+        )
+        return
+
+    # Long polling: Telegram держит запрос до POLLING_TIMEOUT секунд и отдаёт накопившиеся
+    # апдейты пачкой (до 100 за вызов), без пауз между запросами.
+    app.run_polling(
+        allowed_updates=Update.ALL_TYPES,
+        poll_interval=0.0,
+        timeout=int(POLLING_TIMEOUT),
+    )
 
 
 if __name__ == "__main__":
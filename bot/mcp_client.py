@@ -10,23 +10,443 @@
 Этот модуль подключается к такому серверу по Streamable HTTP и вызывает инструменты.
 """
 
+import asyncio
+import hashlib
 import json
 import logging
 import os
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any
+from typing import Any, Awaitable, Callable, TypedDict
 
+import anyio
 from mcp import ClientSession
 from mcp.client.streamable_http import streamable_http_client
 from mcp.types import TextContent
 
+try:
+    import orjson  # необязательно: если установлен, JSON-ответы инструментов парсятся в C
+except ImportError:
+    orjson = None
+
+try:
+    import httpx  # транспорт streamable_http_client; нужен только для типов ошибок
+except ImportError:
+    httpx = None
+
+from .utils.cache import cache_get, cache_put, single_flight
+
 logger = logging.getLogger(__name__)
 
 # Адрес MCP-сервера (можно переопределить через переменную окружения)
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://127.0.0.1:8000/mcp")
+# Просить у сервера компактный формат PR-данных (response_format="compact").
+# Включать, только если сервер поддерживает этот аргумент
+MCP_COMPACT_RESPONSES = os.getenv("MCP_COMPACT_RESPONSES", "0").strip().lower() not in ("0", "false", "no", "")
+
+
+# ==================== Persistent MCP session ====================
+# Одна долгоживущая MCP-сессия на процесс вместо connect + initialize на каждый вызов.
+# Контексты streamable_http_client/ClientSession построены на anyio task group и должны
+# закрываться в той же задаче, где открывались, поэтому сессию держит отдельная фоновая задача.
+
+# Ошибки транспорта, после которых сессию нужно пересоздать
+_RECONNECT_ERRORS = (ConnectionError, OSError, anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)
+_RECONNECT_DELAY = 0.5
+# Инструменты только на чтение: их можно повторить после обрыва. Изменяющие вызовы
+# (task_create, reg_create, user_register, deploy_* ...) не повторяем — запрос мог дойти до сервера
+_RETRYABLE_TOOLS = frozenset({
+    "get_weather", "get_news", "git_branch",
+    "get_pr_info", "get_pr_files", "get_pr_diff",
+    "task_list", "user_get", "reg_find_by_user",
+    "deploy_check_container", "deploy_read_env",
+})
+# Подключение + initialize; если сервер завис, не ждём бесконечно
+MCP_INIT_TIMEOUT = 10.0
+# Сколько вызовов одновременно идёт по общей сессии: запросы мультиплексируются,
+# но веерные сценарии (gather по многим пользователям) не должны заваливать сервер
+MCP_MAX_INFLIGHT = int(os.getenv("MCP_MAX_INFLIGHT", "16"))
+_inflight_sem = asyncio.Semaphore(MCP_MAX_INFLIGHT)
+
+_session_lock = asyncio.Lock()
+_session_ready: "asyncio.Future[ClientSession] | None" = None
+_session_stop: asyncio.Event | None = None
+_session_task: asyncio.Task | None = None
+
+
+async def _session_runner(ready: "asyncio.Future[ClientSession]", stop: asyncio.Event) -> None:
+    try:
+        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
+            async with ClientSession(read_stream, write_stream) as session:
+                await asyncio.wait_for(session.initialize(), MCP_INIT_TIMEOUT)
+                ready.set_result(session)
+                await stop.wait()
+    except asyncio.CancelledError:
+        if not ready.done():
+            ready.cancel()
+        raise
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        else:
+            logger.warning("MCP session closed: %s", e)
+
+
+async def get_mcp_session() -> ClientSession:
+    """Общая MCP-сессия; создаётся при первом обращении и после обрыва соединения."""
+    _, session = await _acquire_mcp_session()
+    return session
+
+
+async def _acquire_mcp_session() -> "tuple[asyncio.Future[ClientSession], ClientSession]":
+    global _session_ready, _session_stop, _session_task
+    async with _session_lock:
+        if _session_task is None or _session_task.done():
+            loop = asyncio.get_running_loop()
+            _session_ready = loop.create_future()
+            _session_stop = asyncio.Event()
+            _session_task = loop.create_task(_session_runner(_session_ready, _session_stop))
+        ready = _session_ready
+    try:
+        return ready, await asyncio.shield(ready)
+    except Exception:
+        await _drop_mcp_session(ready)
+        raise
+
+
+async def _drop_mcp_session(ready: "asyncio.Future[ClientSession] | None" = None) -> None:
+    """Закрывает текущую сессию (если это всё ещё та, с которой работал вызывающий)."""
+    global _session_ready, _session_stop, _session_task
+    async with _session_lock:
+        if ready is not None and ready is not _session_ready:
+            return  # сессию уже пересоздал кто-то другой
+        stop, task = _session_stop, _session_task
+        _session_ready = _session_stop = _session_task = None
+    if stop is not None:
+        stop.set()
+    if task is not None:
+        try:
+            await asyncio.wait_for(task, timeout=5.0)
+        except BaseException:
+            task.cancel()
+
+
+async def close_mcp_session() -> None:
+    """Закрывает общую MCP-сессию (вызывается при остановке бота)."""
+    await _drop_mcp_session()
+
+
+async def call_mcp_tool(name: str, arguments: dict[str, Any] | None = None, timeout: float | None = None):
+    """
+    Вызов MCP-инструмента через общую сессию.
+    При обрыве соединения сессия пересоздаётся; вызов повторяется один раз только
+    для инструментов из _RETRYABLE_TOOLS, изменяющие вызовы пробрасывают ошибку.
+    timeout (секунды) ограничивает весь вызов, включая ожидание сессии; по истечении — asyncio.TimeoutError.
+    """
+    if timeout is not None:
+        return await asyncio.wait_for(call_mcp_tool(name, arguments), timeout)
+
+    attempts = 2 if name in _RETRYABLE_TOOLS else 1
+    for attempt in range(attempts):
+        ready, session = await _acquire_mcp_session()
+        try:
+            async with _inflight_sem:
+                return await session.call_tool(name, arguments=arguments)
+        except _RECONNECT_ERRORS as e:
+            await _drop_mcp_session(ready)
+            if attempt + 1 >= attempts:
+                raise
+            logger.warning("MCP call %s failed (%r), reconnecting", name, e)
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+
+def _result_text(result, *, raw: bool = False) -> str:
+    """
+    Текст ответа инструмента. Обычно это один TextContent — тогда обходимся без склейки.
+    raw=True склеивает куски как есть: для JSON пробел между кусками портит строки внутри.
+    """
+    content = result.content
+    if len(content) == 1 and type(content[0]) is TextContent:
+        return content[0].text.strip()
+    if raw:
+        return "".join(item.text for item in content if type(item) is TextContent).strip()
+    return " ".join(p for p in (item.text.strip() for item in content if type(item) is TextContent) if p)
+
+
+# orjson.JSONDecodeError наследует json.JSONDecodeError, так что обработка ошибок разбора не меняется
+_json_loads = orjson.loads if orjson is not None else json.loads
+# Ответы больше этого размера (символов) разбираются в потоке, чтобы не блокировать event loop
+_JSON_THREAD_THRESHOLD = 16_384
+
+
+# Исключения, означающие «MCP сервер недоступен»
+_CONNECTION_ERRORS = _RECONNECT_ERRORS + (asyncio.TimeoutError,) + ((httpx.TransportError,) if httpx is not None else ())
+
+
+def _is_connection_error(e: BaseException) -> bool:
+    if isinstance(e, _CONNECTION_ERRORS):
+        return True
+    # Ошибки из anyio task group приходят завернутыми в ExceptionGroup
+    group = getattr(e, "exceptions", None)
+    if isinstance(group, tuple):
+        return any(_is_connection_error(sub) for sub in group)
+    # Неизвестный тип — запасной вариант по тексту сообщения
+    error_msg = str(e)
+    return "Connection" in error_msg or "refused" in error_msg
+
+
+def _translate_conn_error(e: BaseException) -> ValueError:
+    logger.error("Connection error to MCP server: %r", e)
+    return ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
+
+
+# Таймауты (секунды) на вызов инструмента: зависший сервер не должен держать хендлер бесконечно.
+# deploy_* сюда не входят — загрузка и запуск образов законно длятся минутами
+_TOOL_TIMEOUTS: dict[str, float] = {
+    "get_pr_diff": 60,
+    "get_pr_files": 30,
+    "get_pr_info": 15,
+    "user_get": 5,
+    "user_register": 10,
+    "user_block": 5,
+    "user_unblock": 5,
+    "user_delete": 10,
+    "reg_create": 10,
+    "reg_find_by_user": 10,
+    "reg_reschedule": 10,
+    "reg_cancel": 5,
+    "task_create": 10,
+    "task_list": 15,
+    "task_delete": 10,
+}
+
+
+# Ошибки MCP сервера начинаются с "Ошибка:" или "error:"; один startswith по кортежу
+# не копирует ответ (diff может занимать сотни КБ)
+_ERROR_PREFIXES = ("Ошибка", "error:", "Error:", "ERROR:")
+
+
+# Запросы «в полёте»: одновременные одинаковые вызовы ждут одну и ту же задачу
+_INFLIGHT: dict[tuple, asyncio.Task] = {}
+
+
+async def _single_flight(key: tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Один вызов factory на key для всех одновременных запросов (см. utils.cache.single_flight)."""
+    return await single_flight(_INFLIGHT, key, factory)
+
+
+async def _call_tool_json(
+    name: str,
+    arguments: dict[str, Any],
+    *,
+    error_label: str,
+    parse_json: bool = True,
+    empty: Any = None,
+    strict_json: bool = True,
+    coalesce: bool = False,
+) -> Any:
+    """
+    Общий путь вызова инструмента: запрос, текст ответа, проверка на ошибку, разбор JSON.
+
+    Args:
+        name: Имя MCP-инструмента
+        arguments: Аргументы инструмента
+        error_label: Начало сообщения для неожиданных исключений ("Ошибка при ...")
+        parse_json: False — вернуть текст ответа без разбора
+        empty: Что вернуть при пустом ответе
+        strict_json: False — невалидный JSON даёт None вместо ValueError
+        coalesce: True — одновременные вызовы с теми же аргументами делят один запрос
+            (только для чтений: результат общий для всех ожидающих)
+
+    Raises:
+        ValueError: ошибка сервера, недоступность MCP или неразборчивый ответ
+    """
+    if coalesce:
+        key = (name, tuple(sorted(arguments.items())))
+        return await _single_flight(key, lambda: _call_tool_json(
+            name, arguments, error_label=error_label, parse_json=parse_json, empty=empty, strict_json=strict_json,
+        ))
+
+    timeout = _TOOL_TIMEOUTS.get(name)
+    try:
+        result = await call_mcp_tool(name, arguments, timeout=timeout)
+    except ValueError:
+        raise
+    except asyncio.TimeoutError as e:
+        if timeout is None:
+            raise _translate_conn_error(e) from e
+        logger.error("MCP tool %s timed out after %ss", name, timeout)
+        raise ValueError(f"MCP сервер не ответил за {timeout:g} с (инструмент {name}). Попробуйте позже.")
+    except Exception as e:
+        if _is_connection_error(e):
+            raise _translate_conn_error(e) from e
+        logger.exception("Exception calling MCP tool %s: %s", name, e)
+        raise ValueError(f"{error_label}: {e}")
+
+    response_text = _result_text(result, raw=parse_json)
+    if not response_text:
+        return empty
+    if response_text.startswith(_ERROR_PREFIXES):
+        logger.error("MCP tool %s returned error: %s", name, response_text)
+        raise ValueError(response_text)
+    if not parse_json:
+        return response_text
+
+    try:
+        if len(response_text) > _JSON_THREAD_THRESHOLD:
+            return await asyncio.to_thread(_json_loads, response_text)
+        return _json_loads(response_text)
+    except json.JSONDecodeError as e:
+        if not strict_json:
+            return None
+        # %.200s обрезает ответ только если запись действительно пишется
+        logger.error("Failed to parse %s JSON: %s. Response: %.200s", name, e, response_text)
+        raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
+
+
+class _CircuitBreaker:
+    """
+    После threshold неудач подряд «размыкается» на reset_after секунд: вызовы сразу
+    получают отказ, не тратя время на заведомо недоступный сервер. Логируются только переходы.
+    """
+
+    def __init__(self, name: str, threshold: int = 3, reset_after: float = 30.0) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def record_success(self) -> None:
+        if self.failures >= self.threshold:
+            logger.info("MCP circuit %s closed", self.name)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.failures == self.threshold:
+                logger.warning("MCP circuit %s opened for %.0fs", self.name, self.reset_after)
+            self.open_until = time.monotonic() + self.reset_after
+
+
+# ==================== Кэш идемпотентных чтений ====================
+# Данные пользователя запрашиваются на каждый вопрос в /support, а закрытый PR уже не меняется:
+# повторные чтения в пределах TTL отдаём из памяти без похода в MCP. Неудачи (None) не кэшируются.
+USER_CACHE_TTL = 300.0
+PR_INFO_CACHE_TTL = 300.0
+MCP_READ_CACHE_MAXSIZE = 2048
+_USER_CACHE: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+_PR_INFO_CACHE: "OrderedDict[tuple[str, str, int], tuple[float, Any]]" = OrderedDict()
+
+
+# Повторяющиеся пробы деплоя и список задач (перерисовки /tasks) — короткие TTL.
+# Любой изменяющий вызов сбрасывает соответствующие записи.
+# deploy_check_docker не кэшируется: он сам устанавливает Docker
+DEPLOY_CHECK_CONTAINER_CACHE_TTL = 5.0
+TASK_LIST_CACHE_TTL = 15.0
+_RESULT_CACHE: "OrderedDict[tuple, tuple[float, Any]]" = OrderedDict()
+_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def _cache_get(cache: OrderedDict, key: Any, ttl: float) -> Any:
+    return cache_get(cache, key, ttl, _CACHE_STATS)
+
+
+def _cache_put(cache: OrderedDict, key: Any, value: Any) -> None:
+    cache_put(cache, key, value, MCP_READ_CACHE_MAXSIZE)
+
+
+def _cacheable(value: Any) -> bool:
+    if value is None:
+        return False
+    # Сервер может пометить результат как некэшируемый (например, живые логи): {"_meta": {"cache_hint": "no-cache"}}
+    if isinstance(value, dict):
+        meta = value.get("_meta")
+        if isinstance(meta, dict) and meta.get("cache_hint") == "no-cache":
+            return False
+        # Ошибки и неуспешные статусы не кэшируем, иначе повтор получит устаревший отказ
+        if value.get("error"):
+            return False
+        if value.get("status") in ("error", "failed", "failure", "not_installed", "not_found"):
+            return False
+    return True
+
+
+async def _cached_read(key: tuple, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    cached = _cache_get(_RESULT_CACHE, key, ttl)
+    if cached is not None:
+        return cached
+    value = await fetch()
+    if _cacheable(value):
+        _cache_put(_RESULT_CACHE, key, value)
+    return value
+
+
+def _deploy_key(tool: str, host: str, port: int, username: str, password: str, *extra: Any) -> tuple:
+    # Пароль в ключ не кладём в открытом виде — только его хэш
+    return (tool, host, port, username, hashlib.blake2b(password.encode(), digest_size=16).digest(), *extra)
+
+
+def _invalidate_results(tool_prefix: str, host: str | None = None, port: int | None = None) -> None:
+    """Сбросить закэшированные результаты инструментов с именем на tool_prefix (для деплоя — только этого сервера)."""
+    for key in [k for k in _RESULT_CACHE if k[0].startswith(tool_prefix) and (host is None or k[1:3] == (host, port))]:
+        del _RESULT_CACHE[key]
+
+
+def get_cache_stats() -> dict[str, Any]:
+    """Статистика кэшей чтения mcp_client: попадания, промахи, доля попаданий."""
+    hits, misses = _CACHE_STATS["hits"], _CACHE_STATS["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+def invalidate_user(username: str) -> None:
+    """
+    Сбросить кэш `user_get` для пользователя. Вызывается после регистрации, блокировки
+    и удаления — в том числе неудачных, ведь состояние на сервере могло успеть измениться.
+    """
+    _USER_CACHE.pop(username, None)
+
+
+# Корень nikita_ai (этот файл — bot/mcp_client.py); путь не меняется, резолвим один раз
+DEFAULT_REPO_PATH = str(Path(__file__).resolve().parent.parent)
+
+# Кэш веток: ветка меняется редко, а /help спрашивает её на каждый вопрос
+GIT_BRANCH_CACHE_TTL = 60.0
+# Ветка в /help — необязательная деталь: ждём её недолго и не дёргаем лежащий сервер
+GIT_BRANCH_TIMEOUT = 2.0
+_GIT_BRANCH_BREAKER = _CircuitBreaker("git_branch", threshold=3, reset_after=30.0)
+_BRANCH_CACHE: dict[str, tuple[float, str]] = {}
 
 
 async def get_git_branch(repo_path: str | None = None) -> str | None:
+    """
+    Текущая ветка git с кэшем на GIT_BRANCH_CACHE_TTL секунд (ключ — абсолютный путь репозитория).
+
+    Одновременные запросы для одного репозитория ждут один вызов MCP. Неудачи (None) не кэшируются.
+    """
+    key = os.path.abspath(repo_path) if repo_path else DEFAULT_REPO_PATH
+    cached = _BRANCH_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < GIT_BRANCH_CACHE_TTL:
+        return cached[1]
+
+    return await _single_flight(("git_branch", key), lambda: _fetch_and_cache_git_branch(key, repo_path))
+
+
+async def _fetch_and_cache_git_branch(key: str, repo_path: str | None) -> str | None:
+    branch_name = await _fetch_git_branch(repo_path)
+    if branch_name is not None:
+        _BRANCH_CACHE[key] = (time.monotonic(), branch_name)
+    return branch_name
+
+
+async def _fetch_git_branch(repo_path: str | None = None) -> str | None:
     """
     Асинхронный вызов MCP-инструмента `git_branch`.
 
@@ -37,47 +457,59 @@ async def get_git_branch(repo_path: str | None = None) -> str | None:
     Returns:
         Название текущей ветки git или None в случае ошибки
     """
+    if not _GIT_BRANCH_BREAKER.allow():
+        return None
+
     try:
         # Если путь не указан, используем путь к nikita_ai репозиторию
-        if repo_path is None:
-            # Определяем корень nikita_ai (где находится этот файл: bot/mcp_client.py)
-            nikita_ai_root = Path(__file__).resolve().parent.parent
-            repo_path = str(nikita_ai_root)
-            logger.debug(f"Автоматически определен путь к nikita_ai: {repo_path}")
-        
-        logger.debug(f"Вызываем git_branch для репозитория: {repo_path}")
-        
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                # Инициализируем MCP-сессию
-                await session.initialize()
-
-                # Вызываем инструмент git_branch с путем к репозиторию
-                result = await session.call_tool(
-                    "git_branch",
-                    arguments={"repo_path": repo_path},
-                )
-
-        # Собираем текстовый контент из результата
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-
-        if not parts:
-            return None
+        repo_path = repo_path or DEFAULT_REPO_PATH
+        logger.debug("Вызываем git_branch для репозитория: %s", repo_path)
 
-        branch_name = " ".join(p.strip() for p in parts if p.strip())
-        # Если это сообщение об ошибке, возвращаем None
-        if "Ошибка" in branch_name or "error" in branch_name.lower():
-            return None
-        
-        return branch_name
+        # Вызываем инструмент git_branch с путем к репозиторию
+        result = await call_mcp_tool(
+            "git_branch",
+            arguments={"repo_path": repo_path},
+            timeout=GIT_BRANCH_TIMEOUT,
+        )
 
     except Exception:
-        # В случае любой ошибки возвращаем None
+        # В случае любой ошибки (в том числе таймаута) возвращаем None
+        _GIT_BRANCH_BREAKER.record_failure()
+        return None
+
+    _GIT_BRANCH_BREAKER.record_success()
+    return _parse_git_branch(result)
+
+
+def _parse_git_branch(result) -> str | None:
+    """Имя ветки из результата инструмента `git_branch` или None, если ответ пустой/ошибка."""
+    # Ошибку инструмента MCP помечает флагом isError — текст ответа тогда не разбираем
+    if getattr(result, "isError", False):
+        return None
+
+    branch_name = _result_text(result)
+    if not branch_name:
         return None
 
+    # Сервер может вернуть ошибку и обычным текстом. Проверяем только начало ответа,
+    # чтобы не отбрасывать ветки вроде fix/error-handling
+    if branch_name.startswith(_ERROR_PREFIXES):
+        return None
+
+    return branch_name
+
+
+async def get_git_branches(repo_paths: list[str]) -> list[str | None]:
+    """
+    Ветки для нескольких репозиториев: повторяющиеся пути запрашиваются один раз,
+    закэшированные не запрашиваются вовсе, остальные вызовы идут параллельно по общей MCP-сессии.
+    Результаты — в порядке repo_paths.
+    """
+    unique_paths = list(dict.fromkeys(repo_paths))
+    results = await asyncio.gather(*(get_git_branch(p) for p in unique_paths), return_exceptions=True)
+    by_path = {p: (None if isinstance(r, BaseException) else r) for p, r in zip(unique_paths, results)}
+    return [by_path[p] for p in repo_paths]
+
 
 async def get_pr_diff(owner: str, repo: str, pr_number: int, github_token: str) -> str | None:
     """
@@ -92,52 +524,43 @@ async def get_pr_diff(owner: str, repo: str, pr_number: int, github_token: str)
     Returns:
         Diff строка или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-
-                result = await session.call_tool(
-                    "get_pr_diff",
-                    arguments={
-                        "owner": owner,
-                        "repo": repo,
-                        "pr_number": pr_number,
-                        "github_token": github_token,
-                    },
-                )
-
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-
-        if not parts:
-            return None
-
-        diff_text = " ".join(p.strip() for p in parts if p.strip())
-        # Проверяем, что это не сообщение об ошибке от MCP сервера
-        # Ошибки обычно начинаются с "Ошибка:" или содержат "error:" в начале
-        if diff_text.startswith("Ошибка") or diff_text.lower().startswith("error:"):
-            logger.error(f"Error getting PR diff: {diff_text}")
-            raise ValueError(diff_text)
-
-        return diff_text
-
-    except ValueError:
-        raise
-    except ConnectionError as e:
-        logger.exception(f"Connection error to MCP server: {e}")
-        raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower() or "timeout" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
-        logger.exception(f"Exception getting PR diff: {e}")
-        raise ValueError(f"Ошибка при получении diff PR через MCP: {e}")
-
-
-async def get_pr_files(owner: str, repo: str, pr_number: int, github_token: str) -> list[dict[str, Any]] | None:
+    return await _call_tool_json(
+        "get_pr_diff",
+        {
+            "owner": owner,
+            "repo": repo,
+            "pr_number": pr_number,
+            "github_token": github_token,
+        },
+        error_label="Ошибка при получении diff PR через MCP",
+        parse_json=False,
+    )
+
+
+class PRFileCompact(TypedDict, total=False):
+    """Поля файла PR, которые использует бот (patch не нужен: diff запрашивается отдельно)."""
+    filename: str
+    status: str
+    additions: int
+    deletions: int
+
+
+_PR_FILE_FIELDS = tuple(PRFileCompact.__annotations__)
+
+
+def _pr_args(owner: str, repo: str, pr_number: int, github_token: str) -> dict[str, Any]:
+    arguments = {
+        "owner": owner,
+        "repo": repo,
+        "pr_number": pr_number,
+        "github_token": github_token,
+    }
+    if MCP_COMPACT_RESPONSES:
+        arguments["response_format"] = "compact"
+    return arguments
+
+
+async def get_pr_files(owner: str, repo: str, pr_number: int, github_token: str) -> list[PRFileCompact] | None:
     """
     Асинхронный вызов MCP-инструмента `get_pr_files`.
 
@@ -148,56 +571,17 @@ async def get_pr_files(owner: str, repo: str, pr_number: int, github_token: str)
         github_token: GitHub token
 
     Returns:
-        Список словарей с информацией о файлах или None в случае ошибки
+        Список файлов (только поля PRFileCompact) или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-
-                result = await session.call_tool(
-                    "get_pr_files",
-                    arguments={
-                        "owner": owner,
-                        "repo": repo,
-                        "pr_number": pr_number,
-                        "github_token": github_token,
-                    },
-                )
-
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-
-        if not parts:
-            logger.error("MCP tool get_pr_files returned empty response")
-            return None
-
-        files_json = " ".join(p.strip() for p in parts if p.strip())
-        # Проверяем, что это не сообщение об ошибке от MCP сервера
-        # Ошибки обычно начинаются с "Ошибка:" или содержат "error:" в начале
-        if files_json.startswith("Ошибка") or files_json.lower().startswith("error:"):
-            logger.error(f"Error getting PR files: {files_json}")
-            raise ValueError(files_json)
-
-        try:
-            return json.loads(files_json)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse PR files JSON: {e}. Response: {files_json[:200]}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-
-    except ValueError:
-        raise
-    except ConnectionError as e:
-        logger.exception(f"Connection error to MCP server: {e}")
-        raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower() or "timeout" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
-        logger.exception(f"Exception getting PR files: {e}")
-        raise ValueError(f"Ошибка при получении файлов PR через MCP: {e}")
+    files = await _call_tool_json(
+        "get_pr_files",
+        _pr_args(owner, repo, pr_number, github_token),
+        error_label="Ошибка при получении файлов PR через MCP",
+    )
+    if not isinstance(files, list):
+        return files
+    # Полный ответ GitHub несёт patch и ссылки на каждый файл; держим в памяти только нужное
+    return [{k: f[k] for k in _PR_FILE_FIELDS if k in f} for f in files if isinstance(f, dict)]
 
 
 async def get_pr_info(owner: str, repo: str, pr_number: int, github_token: str) -> dict[str, Any] | None:
@@ -213,54 +597,63 @@ async def get_pr_info(owner: str, repo: str, pr_number: int, github_token: str)
     Returns:
         Словарь с информацией о PR или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-
-                result = await session.call_tool(
-                    "get_pr_info",
-                    arguments={
-                        "owner": owner,
-                        "repo": repo,
-                        "pr_number": pr_number,
-                        "github_token": github_token,
-                    },
-                )
-
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-
-        if not parts:
-            return None
-
-        info_json = " ".join(p.strip() for p in parts if p.strip())
-        # Проверяем, что это не сообщение об ошибке от MCP сервера
-        # Ошибки обычно начинаются с "Ошибка:" или содержат "error:" в начале
-        if info_json.startswith("Ошибка") or info_json.lower().startswith("error:"):
-            logger.error(f"Error getting PR info: {info_json}")
-            raise ValueError(info_json)
+    key = (owner, repo, pr_number)
+    cached = _cache_get(_PR_INFO_CACHE, key, PR_INFO_CACHE_TTL)
+    if cached is not None:
+        return cached
+
+    pr_info = await _call_tool_json(
+        "get_pr_info",
+        _pr_args(owner, repo, pr_number, github_token),
+        error_label="Ошибка при получении информации о PR через MCP",
+        coalesce=True,
+    )
+    # Кэшируем только закрытые/смерженные PR: открытый могут обновить в любой момент
+    if isinstance(pr_info, dict) and (pr_info.get("state") in ("closed", "merged") or pr_info.get("merged")):
+        _cache_put(_PR_INFO_CACHE, key, pr_info)
+    return pr_info
+
+
+async def get_pr_bundle(owner: str, repo: str, pr_number: int, github_token: str) -> dict[str, Any]:
+    """
+    Информация, файлы и diff PR одним вызовом.
 
-        try:
-            return json.loads(info_json)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse PR info JSON: {e}. Response: {info_json[:200]}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
+    Три запроса независимы, поэтому идут параллельно по общей MCP-сессии:
+    время ожидания — самый долгий из них, а не сумма.
 
-    except ValueError:
-        raise
-    except ConnectionError as e:
-        logger.exception(f"Connection error to MCP server: {e}")
-        raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower() or "timeout" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}. Убедитесь, что сервер запущен.")
-        logger.exception(f"Exception getting PR info: {e}")
-        raise ValueError(f"Ошибка при получении информации о PR через MCP: {e}")
+    Returns:
+        {"info": ..., "files": ..., "diff": ...}
 
+    Raises:
+        ValueError: ошибки всех упавших запросов, собранные в одно исключение
+    """
+    results = await asyncio.gather(
+        get_pr_info(owner, repo, pr_number, github_token),
+        get_pr_files(owner, repo, pr_number, github_token),
+        get_pr_diff(owner, repo, pr_number, github_token),
+        return_exceptions=True,
+    )
+    _raise_gathered_errors(results)
+    info, files, diff = results
+    return {"info": info, "files": files, "diff": diff}
+
+
+def _raise_gathered_errors(results: list[Any]) -> None:
+    """
+    Разбор результата gather(..., return_exceptions=True).
+    Неожиданные исключения пробрасываются как есть, ValueError склеиваются в одно
+    (одинаковые сообщения — например, «сервер недоступен» от всех вызовов — не дублируются).
+    """
+    errors: list[str] = []
+    for res in results:
+        if isinstance(res, ValueError):
+            msg = str(res)
+            if msg not in errors:
+                errors.append(msg)
+        elif isinstance(res, BaseException):
+            raise res
+    if errors:
+        raise ValueError(errors[0] if len(errors) == 1 else "\n".join(errors))
 
 # ==================== Google Sheets MCP Client Functions ====================
 
@@ -274,43 +667,19 @@ async def user_get(username: str) -> dict[str, Any] | None:
     Returns:
         Словарь с данными пользователя или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "user_get",
-                    arguments={"username": username},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error getting user: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse user data JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception getting user: {e}")
-        raise ValueError(f"Ошибка при получении данных пользователя: {e}")
+    cached = _cache_get(_USER_CACHE, username, USER_CACHE_TTL)
+    if cached is not None:
+        return cached
+
+    user_data = await _call_tool_json(
+        "user_get",
+        {"username": username},
+        error_label="Ошибка при получении данных пользователя",
+        coalesce=True,
+    )
+    if user_data is not None:
+        _cache_put(_USER_CACHE, username, user_data)
+    return user_data
 
 
 async def user_register(username: str, fio: str, phone: str) -> dict[str, Any] | None:
@@ -326,46 +695,17 @@ async def user_register(username: str, fio: str, phone: str) -> dict[str, Any] |
         Словарь со статусом операции или None в случае ошибки
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "user_register",
-                    arguments={
-                        "username": username,
-                        "fio": fio,
-                        "phone": phone,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error registering user: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse registration response JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception registering user: {e}")
-        raise ValueError(f"Ошибка при регистрации пользователя: {e}")
+        return await _call_tool_json(
+            "user_register",
+            {
+                "username": username,
+                "fio": fio,
+                "phone": phone,
+            },
+            error_label="Ошибка при регистрации пользователя",
+        )
+    finally:
+        invalidate_user(username)
 
 
 async def user_block(username: str) -> bool:
@@ -379,38 +719,14 @@ async def user_block(username: str) -> bool:
         True если успешно, иначе выбрасывает ValueError
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "user_block",
-                    arguments={"username": username},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return False
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error blocking user: {response_text}")
-            raise ValueError(response_text)
-        
-        return True
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception blocking user: {e}")
-        raise ValueError(f"Ошибка при блокировке пользователя: {e}")
+        return bool(await _call_tool_json(
+            "user_block",
+            {"username": username},
+            error_label="Ошибка при блокировке пользователя",
+            parse_json=False,
+        ))
+    finally:
+        invalidate_user(username)
 
 
 async def user_unblock(username: str) -> bool:
@@ -424,38 +740,14 @@ async def user_unblock(username: str) -> bool:
         True если успешно, иначе выбрасывает ValueError
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "user_unblock",
-                    arguments={"username": username},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return False
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error unblocking user: {response_text}")
-            raise ValueError(response_text)
-        
-        return True
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception unblocking user: {e}")
-        raise ValueError(f"Ошибка при разблокировке пользователя: {e}")
+        return bool(await _call_tool_json(
+            "user_unblock",
+            {"username": username},
+            error_label="Ошибка при разблокировке пользователя",
+            parse_json=False,
+        ))
+    finally:
+        invalidate_user(username)
 
 
 async def user_delete(username: str) -> bool:
@@ -469,43 +761,26 @@ async def user_delete(username: str) -> bool:
         True если успешно, иначе False
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "user_delete",
-                    arguments={"username": username},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
+        response_text = await _call_tool_json(
+            "user_delete",
+            {"username": username},
+            error_label="Ошибка при удалении пользователя",
+            parse_json=False,
+        )
+        if not response_text:
             return False
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error deleting user: {response_text}")
-            raise ValueError(response_text)
-        
+        # Компактный ответ "ok" — без разбора JSON; ниже прежний формат {"status": "deleted"}
+        if response_text.startswith("ok"):
+            return True
+
         try:
-            response_data = json.loads(response_text)
+            response_data = _json_loads(response_text)
             return response_data.get("status") == "deleted"
         except json.JSONDecodeError:
             # Если не JSON, проверяем текстовый ответ
             return "удален" in response_text.lower() or "deleted" in response_text.lower()
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception deleting user: {e}")
-        raise ValueError(f"Ошибка при удалении пользователя: {e}")
+    finally:
+        invalidate_user(username)
 
 
 async def reg_create(username: str, date: str, time: str, note: str = "") -> dict[str, Any] | None:
@@ -521,51 +796,19 @@ async def reg_create(username: str, date: str, time: str, note: str = "") -> dic
     Returns:
         Словарь с данными созданной записи или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                arguments = {
-                    "username": username,
-                    "date": date,
-                    "time": time,
-                }
-                if note:
-                    arguments["note"] = note
-                
-                result = await session.call_tool(
-                    "reg_create",
-                    arguments=arguments,
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error creating registration: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse registration creation response JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception creating registration: {e}")
-        raise ValueError(f"Ошибка при создании записи: {e}")
+    arguments = {
+        "username": username,
+        "date": date,
+        "time": time,
+    }
+    if note:
+        arguments["note"] = note
+
+    return await _call_tool_json(
+        "reg_create",
+        arguments,
+        error_label="Ошибка при создании записи",
+    )
 
 
 async def reg_find_by_user(username: str) -> list[dict[str, Any]] | None:
@@ -578,43 +821,48 @@ async def reg_find_by_user(username: str) -> list[dict[str, Any]] | None:
     Returns:
         Список словарей с данными записей или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "reg_find_by_user",
-                    arguments={"username": username},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return []
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error finding registrations: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse registrations JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception finding registrations: {e}")
-        raise ValueError(f"Ошибка при поиске записей: {e}")
+    return await _call_tool_json(
+        "reg_find_by_user",
+        {"username": username},
+        error_label="Ошибка при поиске записей",
+        empty=[],
+        coalesce=True,
+    )
+
+
+async def fetch_user_context(username: str) -> tuple[dict[str, Any] | None, list[dict[str, Any]]]:
+    """
+    Данные пользователя и его активные записи для контекста LLM.
+
+    Оба запроса идут параллельно по общей MCP-сессии. Контекст необязательный:
+    упавшая часть логируется и заменяется пустым значением.
+
+    Returns:
+        (user_data или None, список активных записей)
+    """
+    user_res, regs_res = await asyncio.gather(
+        user_get(username),
+        reg_find_by_user(username),
+        return_exceptions=True,
+    )
+
+    user_data = None
+    if isinstance(user_res, ValueError):
+        logger.warning("Could not get user data: %s", user_res)
+    elif isinstance(user_res, BaseException):
+        raise user_res
+    else:
+        user_data = user_res
+
+    active_regs: list[dict[str, Any]] = []
+    if isinstance(regs_res, ValueError):
+        logger.warning("Could not get user registrations: %s", regs_res)
+    elif isinstance(regs_res, BaseException):
+        raise regs_res
+    else:
+        active_regs = regs_res or []
+
+    return user_data, active_regs
 
 
 async def reg_reschedule(reg_id: int, new_date: str, new_time: str) -> dict[str, Any] | None:
@@ -629,47 +877,15 @@ async def reg_reschedule(reg_id: int, new_date: str, new_time: str) -> dict[str,
     Returns:
         Словарь с обновленными данными записи или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "reg_reschedule",
-                    arguments={
-                        "reg_id": reg_id,
-                        "new_date": new_date,
-                        "new_time": new_time,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error rescheduling registration: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse reschedule response JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception rescheduling registration: {e}")
-        raise ValueError(f"Ошибка при переносе записи: {e}")
+    return await _call_tool_json(
+        "reg_reschedule",
+        {
+            "reg_id": reg_id,
+            "new_date": new_date,
+            "new_time": new_time,
+        },
+        error_label="Ошибка при переносе записи",
+    )
 
 
 async def reg_cancel(reg_id: int) -> bool:
@@ -682,40 +898,12 @@ async def reg_cancel(reg_id: int) -> bool:
     Returns:
         True если успешно, иначе выбрасывает ValueError
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "reg_cancel",
-                    arguments={"reg_id": reg_id},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return False
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error canceling registration: {response_text}")
-            raise ValueError(response_text)
-        
-        return True
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception canceling registration: {e}")
-        raise ValueError(f"Ошибка при отмене записи: {e}")
-
+    return bool(await _call_tool_json(
+        "reg_cancel",
+        {"reg_id": reg_id},
+        error_label="Ошибка при отмене записи",
+        parse_json=False,
+    ))
 
 # ==================== Task Management MCP Client Functions ====================
 
@@ -733,47 +921,18 @@ async def task_create(date: str, time: str, task: str, priority: str) -> dict[st
         Словарь с данными созданной задачи или None в случае ошибки
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "task_create",
-                    arguments={
-                        "date": date,
-                        "time": time,
-                        "task": task,
-                        "priority": priority,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error creating task: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse task creation response JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception creating task: {e}")
-        raise ValueError(f"Ошибка при создании задачи: {e}")
+        return await _call_tool_json(
+            "task_create",
+            {
+                "date": date,
+                "time": time,
+                "task": task,
+                "priority": priority,
+            },
+            error_label="Ошибка при создании задачи",
+        )
+    finally:
+        _invalidate_results("task_list")
 
 
 async def task_list(priority: str | None = None, completed: bool | None = None, date_from: str | None = None, date_to: str | None = None) -> list[dict[str, Any]] | None:
@@ -789,53 +948,26 @@ async def task_list(priority: str | None = None, completed: bool | None = None,
     Returns:
         Список словарей с данными задач или None в случае ошибки
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                arguments = {}
-                if priority is not None:
-                    arguments["priority"] = priority
-                if completed is not None:
-                    arguments["completed"] = completed
-                if date_from is not None:
-                    arguments["date_from"] = date_from
-                if date_to is not None:
-                    arguments["date_to"] = date_to
-                
-                result = await session.call_tool(
-                    "task_list",
-                    arguments=arguments,
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return []
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error getting task list: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse task list JSON: {e}")
-            raise ValueError(f"Не удалось разобрать ответ от MCP сервера: {e}")
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception getting task list: {e}")
-        raise ValueError(f"Ошибка при получении списка задач: {e}")
+    arguments = {}
+    if priority is not None:
+        arguments["priority"] = priority
+    if completed is not None:
+        arguments["completed"] = completed
+    if date_from is not None:
+        arguments["date_from"] = date_from
+    if date_to is not None:
+        arguments["date_to"] = date_to
+
+    return await _cached_read(
+        ("task_list", priority, completed, date_from, date_to),
+        TASK_LIST_CACHE_TTL,
+        lambda: _call_tool_json(
+            "task_list",
+            arguments,
+            error_label="Ошибка при получении списка задач",
+            empty=[],
+        ),
+    )
 
 
 async def task_delete(row_number: int) -> dict | None:
@@ -849,30 +981,17 @@ async def task_delete(row_number: int) -> dict | None:
         dict с полями status ("deleted" или "cleared") и message (опционально), или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "task_delete",
-                    arguments={"row_number": row_number},
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
+        response_text = await _call_tool_json(
+            "task_delete",
+            {"row_number": row_number},
+            error_label="Ошибка при удалении задачи",
+            parse_json=False,
+        )
+        if not response_text:
             return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error deleting task: {response_text}")
-            raise ValueError(response_text)
-        
+
         try:
-            response_data = json.loads(response_text)
+            response_data = _json_loads(response_text)
             # Возвращаем dict с информацией о статусе
             status = response_data.get("status")
             if status in ["deleted", "cleared"]:
@@ -889,16 +1008,8 @@ async def task_delete(row_number: int) -> dict | None:
             if "очищен" in response_text.lower() or "cleared" in response_text.lower():
                 return {"status": "cleared", "row_number": row_number, "message": ""}
             return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception deleting task: {e}")
-        raise ValueError(f"Ошибка при удалении задачи: {e}")
-
+    finally:
+        _invalidate_results("task_list")
 
 # ==================== DEPLOY FUNCTIONS ====================
 
@@ -915,47 +1026,17 @@ async def deploy_check_docker(host: str, port: int, username: str, password: str
     Returns:
         dict с результатом проверки/установки Docker или None при ошибке
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_check_docker",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error checking Docker: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception checking Docker: {e}")
-        raise ValueError(f"Ошибка при проверке Docker: {e}")
+    return await _call_tool_json(
+        "deploy_check_docker",
+        {
+            "host": host,
+            "port": port,
+            "username": username,
+            "password": password,
+        },
+        error_label="Ошибка при проверке Docker",
+        strict_json=False,
+    )
 
 
 async def deploy_upload_image(host: str, port: int, username: str, password: str, image_tar_path: str, remote_path: str) -> dict | None:
@@ -974,48 +1055,21 @@ async def deploy_upload_image(host: str, port: int, username: str, password: str
         dict с результатом загрузки или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_upload_image",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "image_tar_path": image_tar_path,
-                        "remote_path": remote_path,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error uploading image: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception uploading image: {e}")
-        raise ValueError(f"Ошибка при загрузке образа: {e}")
+        return await _call_tool_json(
+            "deploy_upload_image",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "image_tar_path": image_tar_path,
+                "remote_path": remote_path,
+            },
+            error_label="Ошибка при загрузке образа",
+            strict_json=False,
+        )
+    finally:
+        _invalidate_results("deploy_", host, port)
 
 
 async def deploy_load_image(host: str, port: int, username: str, password: str, image_tar_path: str) -> dict | None:
@@ -1033,47 +1087,20 @@ async def deploy_load_image(host: str, port: int, username: str, password: str,
         dict с результатом загрузки образа или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_load_image",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "image_tar_path": image_tar_path,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error loading image: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception loading image: {e}")
-        raise ValueError(f"Ошибка при загрузке образа в Docker: {e}")
+        return await _call_tool_json(
+            "deploy_load_image",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "image_tar_path": image_tar_path,
+            },
+            error_label="Ошибка при загрузке образа в Docker",
+            strict_json=False,
+        )
+    finally:
+        _invalidate_results("deploy_", host, port)
 
 
 async def deploy_create_compose(host: str, port: int, username: str, password: str, compose_content: str, remote_path: str = "/opt/nikita_ai/docker-compose.yml") -> dict | None:
@@ -1092,48 +1119,21 @@ async def deploy_create_compose(host: str, port: int, username: str, password: s
         dict с результатом создания/обновления файла или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_create_compose",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "compose_content": compose_content,
-                        "remote_path": remote_path,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error creating compose: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception creating compose: {e}")
-        raise ValueError(f"Ошибка при создании docker-compose.yml: {e}")
+        return await _call_tool_json(
+            "deploy_create_compose",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "compose_content": compose_content,
+                "remote_path": remote_path,
+            },
+            error_label="Ошибка при создании docker-compose.yml",
+            strict_json=False,
+        )
+    finally:
+        _invalidate_results("deploy_", host, port)
 
 
 async def deploy_create_env(host: str, port: int, username: str, password: str, env_content: str, remote_path: str = "/opt/nikita_ai/.env") -> dict | None:
@@ -1152,48 +1152,51 @@ async def deploy_create_env(host: str, port: int, username: str, password: str,
         dict с результатом создания/обновления файла или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_create_env",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "env_content": env_content,
-                        "remote_path": remote_path,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error creating env: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception creating env: {e}")
-        raise ValueError(f"Ошибка при создании .env файла: {e}")
+        return await _call_tool_json(
+            "deploy_create_env",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "env_content": env_content,
+                "remote_path": remote_path,
+            },
+            error_label="Ошибка при создании .env файла",
+            strict_json=False,
+        )
+    finally:
+        _invalidate_results("deploy_", host, port)
+
+
+async def deploy_prepare_files(
+    host: str,
+    port: int,
+    username: str,
+    password: str,
+    compose_content: str,
+    env_content: str,
+    compose_path: str = "/opt/nikita_ai/docker-compose.yml",
+    env_path: str = "/opt/nikita_ai/.env",
+) -> tuple[dict | None, dict | None]:
+    """
+    Создаёт docker-compose.yml и .env на сервере параллельно: шаги независимы,
+    поэтому этап занимает время самого долгого из них, а не сумму.
+
+    Returns:
+        (результат deploy_create_compose, результат deploy_create_env)
+
+    Raises:
+        ValueError: ошибки упавших шагов, собранные в одно исключение
+    """
+    results = await asyncio.gather(
+        deploy_create_compose(host, port, username, password, compose_content, compose_path),
+        deploy_create_env(host, port, username, password, env_content, env_path),
+        return_exceptions=True,
+    )
+    _raise_gathered_errors(results)
+    compose_result, env_result = results
+    return compose_result, env_result
 
 
 async def deploy_start_bot(host: str, port: int, username: str, password: str, compose_path: str = "/opt/nikita_ai/docker-compose.yml") -> dict | None:
@@ -1211,47 +1214,20 @@ async def deploy_start_bot(host: str, port: int, username: str, password: str, c
         dict с результатом запуска или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_start_bot",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "compose_path": compose_path,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error starting bot: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception starting bot: {e}")
-        raise ValueError(f"Ошибка при запуске бота: {e}")
+        return await _call_tool_json(
+            "deploy_start_bot",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "compose_path": compose_path,
+            },
+            error_label="Ошибка при запуске бота",
+            strict_json=False,
+        )
+    finally:
+        _invalidate_results("deploy_", host, port)
 
 
 async def deploy_check_container(host: str, port: int, username: str, password: str, container_name: str = "nikita_ai_bot") -> dict | None:
@@ -1268,48 +1244,22 @@ async def deploy_check_container(host: str, port: int, username: str, password:
     Returns:
         dict с результатом проверки и логами или None при ошибке
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_check_container",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "container_name": container_name,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error checking container: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception checking container: {e}")
-        raise ValueError(f"Ошибка при проверке контейнера: {e}")
+    return await _cached_read(
+        _deploy_key("deploy_check_container", host, port, username, password, container_name),
+        DEPLOY_CHECK_CONTAINER_CACHE_TTL,
+        lambda: _call_tool_json(
+            "deploy_check_container",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "container_name": container_name,
+            },
+            error_label="Ошибка при проверке контейнера",
+            strict_json=False,
+        ),
+    )
 
 
 async def deploy_read_env(host: str, port: int, username: str, password: str, env_path: str = "/opt/nikita_ai/.env") -> dict | None:
@@ -1326,48 +1276,18 @@ async def deploy_read_env(host: str, port: int, username: str, password: str, en
     Returns:
         dict с содержимым .env файла или None при ошибке
     """
-    try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_read_env",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "env_path": env_path,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error reading env: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception reading env: {e}")
-        raise ValueError(f"Ошибка при чтении .env файла: {e}")
+    return await _call_tool_json(
+        "deploy_read_env",
+        {
+            "host": host,
+            "port": port,
+            "username": username,
+            "password": password,
+            "env_path": env_path,
+        },
+        error_label="Ошибка при чтении .env файла",
+        strict_json=False,
+    )
 
 
 async def deploy_stop_bot(host: str, port: int, username: str, password: str, compose_path: str = "/opt/nikita_ai/docker-compose.yml", remove_volumes: bool = False, remove_images: bool = False) -> dict | None:
@@ -1387,46 +1307,19 @@ async def deploy_stop_bot(host: str, port: int, username: str, password: str, co
         dict с результатом остановки или None при ошибке
     """
     try:
-        async with streamable_http_client(MCP_SERVER_URL) as (read_stream, write_stream, _):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                
-                result = await session.call_tool(
-                    "deploy_stop_bot",
-                    arguments={
-                        "host": host,
-                        "port": port,
-                        "username": username,
-                        "password": password,
-                        "compose_path": compose_path,
-                        "remove_volumes": remove_volumes,
-                        "remove_images": remove_images,
-                    },
-                )
-        
-        parts: list[str] = []
-        for item in result.content:
-            if isinstance(item, TextContent):
-                parts.append(item.text)
-        
-        if not parts:
-            return None
-        
-        response_text = " ".join(p.strip() for p in parts if p.strip())
-        if response_text.startswith("Ошибка") or response_text.lower().startswith("error:"):
-            logger.error(f"Error stopping bot: {response_text}")
-            raise ValueError(response_text)
-        
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            return None
-    
-    except ValueError:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if "Connection" in error_msg or "refused" in error_msg.lower():
-            raise ValueError(f"Не удалось подключиться к MCP серверу по адресу {MCP_SERVER_URL}")
-        logger.exception(f"Exception stopping bot: {e}")
-        raise ValueError(f"Ошибка при остановке бота: {e}")
+        return await _call_tool_json(
+            "deploy_stop_bot",
+            {
+                "host": host,
+                "port": port,
+                "username": username,
+                "password": password,
+                "compose_path": compose_path,
+                "remove_volumes": remove_volumes,
+                "remove_images": remove_images,
+            },
+            error_label="Ошибка при остановке бота",
+            strict_json=False,
+        )
+    finally:
+        _invalidate_results("deploy_", host, port)
@@ -1,5 +1,12 @@
 import requests
+from requests.adapters import HTTPAdapter
+import httpx  # ставится вместе с python-telegram-bot
 import logging
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterator
 from .config import OPENROUTER_API_KEY, OPENROUTER_MODEL
 
 logger = logging.getLogger(__name__)
@@ -15,6 +22,64 @@ def _headers() -> dict:
     }
 
 
+def _build_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Одна keep-alive сессия на процесс: без TCP/TLS рукопожатия на каждый запрос к OpenRouter.
+# Пул на 50 соединений — запросы идут из asyncio.to_thread параллельно.
+HTTP_SESSION = _build_http_session()
+
+
+def close_http_session() -> None:
+    HTTP_SESSION.close()
+
+
+try:
+    import h2  # noqa: F401  — нужен httpx для HTTP/2
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+# Асинхронный клиент для вызовов прямо из event loop: без прыжка в поток,
+# keep-alive и (если установлен h2) HTTP/2 к OpenRouter.
+_ASYNC_CLIENT: httpx.AsyncClient | None = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None or _ASYNC_CLIENT.is_closed:
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300),
+            http2=_HTTP2_AVAILABLE,
+        )
+    return _ASYNC_CLIENT
+
+
+async def close_async_client() -> None:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
+
+
+def _raise_api_error(status_code: int, error_detail, payload: dict) -> None:
+    """Логирует ошибку OpenRouter и выбрасывает HTTPError с понятным сообщением, если оно есть."""
+    logger.error(f"OpenRouter API error {status_code}: {error_detail}")
+    logger.error(f"Request payload: model={payload.get('model')}, messages_count={len(payload.get('messages', []))}")
+
+    # Пытаемся извлечь более понятное сообщение об ошибке
+    if isinstance(error_detail, dict):
+        error_msg = error_detail.get("error", {}).get("message", "") if isinstance(error_detail.get("error"), dict) else str(error_detail)
+        if error_msg:
+            raise requests.exceptions.HTTPError(f"OpenRouter API error: {error_msg}")
+
+
 def chat_completion_raw(
     messages,
     timeout: int = 60,
@@ -28,7 +93,7 @@ def chat_completion_raw(
     }
 
     try:
-        r = requests.post(OPENROUTER_CHAT_URL, headers=_headers(), json=payload, timeout=timeout)
+        r = HTTP_SESSION.post(OPENROUTER_CHAT_URL, headers=_headers(), json=payload, timeout=timeout)
         
         # Логируем детали ошибки перед raise_for_status
         if r.status_code != 200:
@@ -37,15 +102,7 @@ def chat_completion_raw(
                 error_detail = r.json()
             except:
                 error_detail = r.text[:500]
-            
-            logger.error(f"OpenRouter API error {r.status_code}: {error_detail}")
-            logger.error(f"Request payload: model={payload.get('model')}, messages_count={len(payload.get('messages', []))}")
-            
-            # Пытаемся извлечь более понятное сообщение об ошибке
-            if isinstance(error_detail, dict):
-                error_msg = error_detail.get("error", {}).get("message", "") if isinstance(error_detail.get("error"), dict) else str(error_detail)
-                if error_msg:
-                    raise requests.exceptions.HTTPError(f"OpenRouter API error: {error_msg}")
+            _raise_api_error(r.status_code, error_detail, payload)
         
         r.raise_for_status()
         return r.json()
@@ -57,6 +114,31 @@ def chat_completion_raw(
         raise
 
 
+async def chat_completion_raw_async(
+    messages,
+    timeout: int = 60,
+    temperature: float = 0.7,
+    model: str | None = None,
+) -> dict:
+    """chat_completion_raw без потока: запрос идёт через общий httpx.AsyncClient прямо из event loop."""
+    payload = {
+        "model": model or OPENROUTER_MODEL,
+        "messages": messages,
+        "temperature": float(temperature),
+    }
+
+    r = await get_async_client().post(OPENROUTER_CHAT_URL, headers=_headers(), json=payload, timeout=timeout)
+    if r.status_code != 200:
+        try:
+            error_detail = r.json()
+        except ValueError:
+            error_detail = r.text[:500]
+        _raise_api_error(r.status_code, error_detail, payload)
+        # Тот же тип исключения, что и у синхронной версии
+        raise requests.exceptions.HTTPError(f"OpenRouter API error {r.status_code}: {r.text[:200]}")
+    return r.json()
+
+
 def chat_completion(
     messages,
     timeout: int = 60,
@@ -70,6 +152,76 @@ def chat_completion(
         return ""
 
 
+def chat_completion_stream(
+    messages,
+    timeout: int = 60,
+    temperature: float = 0.7,
+    model: str | None = None,
+) -> Iterator[str]:
+    """Потоковый ответ OpenRouter (SSE): отдаёт куски текста по мере генерации."""
+    payload = {
+        "model": model or OPENROUTER_MODEL,
+        "messages": messages,
+        "temperature": float(temperature),
+        "stream": True,
+    }
+
+    with HTTP_SESSION.post(OPENROUTER_CHAT_URL, headers=_headers(), json=payload, timeout=timeout, stream=True) as r:
+        if r.status_code != 200:
+            logger.error(f"OpenRouter API error {r.status_code} (stream): {r.text[:500]}")
+        r.raise_for_status()
+        for line in r.iter_lines():
+            # пустые строки и SSE-комментарии (": OPENROUTER PROCESSING") пропускаем
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            delta = (((chunk.get("choices") or [{}])[0].get("delta") or {}).get("content")) or ""
+            if delta:
+                yield delta
+
+
+# Клиентский префиксный кэш: одинаковый набор messages (+модель/температура) → готовый ответ.
+# Первые ходы /tz_creation_site и /forest_split одинаковы для всех пользователей.
+PREFIX_CACHE_MAX_SIZE = 256
+PREFIX_CACHE: "OrderedDict[bytes, str]" = OrderedDict()
+_prefix_cache_lock = threading.Lock()  # вызывается из asyncio.to_thread
+
+
+def _messages_key(messages, temperature: float, model: str | None) -> bytes:
+    blob = json.dumps([model or OPENROUTER_MODEL, float(temperature), messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).digest()
+
+
+def chat_completion_cached(
+    messages,
+    timeout: int = 60,
+    temperature: float = 0.7,
+    model: str | None = None,
+) -> str:
+    """chat_completion с кэшем по хэшу всего запроса; пустые ответы не кэшируются."""
+    key = _messages_key(messages, temperature, model)
+    with _prefix_cache_lock:
+        cached = PREFIX_CACHE.get(key)
+        if cached is not None:
+            PREFIX_CACHE.move_to_end(key)
+            logger.debug("Prefix cache hit")
+            return cached
+
+    answer = chat_completion(messages, timeout=timeout, temperature=temperature, model=model)
+    if answer:
+        with _prefix_cache_lock:
+            PREFIX_CACHE[key] = answer
+            if len(PREFIX_CACHE) > PREFIX_CACHE_MAX_SIZE:
+                PREFIX_CACHE.popitem(last=False)
+    return answer
+
+
 def transcribe_audio(
     audio_bytes: bytes,
     model: str | None = None,
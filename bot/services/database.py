@@ -3,9 +3,10 @@
 import sqlite3
 import logging
 from pathlib import Path
-from datetime import datetime, timezone
 import os
 
+from ..utils.helpers import utc_now_iso
+
 logger = logging.getLogger(__name__)
 
 # Constants
@@ -24,11 +25,6 @@ def build_messages_with_db_memory(system_prompt: str, chat_id: int) -> list[dict
     return [{"role": "system", "content": system_prompt}] + history
 
 
-def utc_now_iso() -> str:
-    """Get current UTC time as ISO string."""
-    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
-
-
 def open_db() -> sqlite3.Connection:
     """Open database connection."""
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -244,6 +240,28 @@ def db_add_message(chat_id: int, mode: str, role: str, content: str) -> None:
         logger.exception("DB add message failed: %s", e)
 
 
+def db_add_messages_batch(chat_id: int, mode: str, rows: list[tuple[str, str]]) -> None:
+    """Add several (role, content) messages in a single transaction (one commit per turn)."""
+    now = utc_now_iso()
+    params = [
+        (int(chat_id), str(mode), str(role), content, now)
+        for role, text in rows
+        if (content := (text or "").strip())
+    ]
+    if not params:
+        return
+
+    try:
+        with open_db() as conn:
+            conn.executemany(
+                "INSERT INTO messages(chat_id, mode, role, content, created_at) VALUES(?, ?, ?, ?, ?)",
+                params,
+            )
+            conn.commit()
+    except Exception as e:
+        logger.exception("DB add messages batch failed: %s", e)
+
+
 def db_get_messages(chat_id: int, mode: str, limit: int = MEMORY_LIMIT_MESSAGES) -> list[dict]:
     """Get messages from database."""
     try:
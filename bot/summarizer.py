@@ -1,12 +1,12 @@
 import os
 import sqlite3
-from datetime import datetime, timezone
 from pathlib import Path
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from .openrouter import chat_completion
+from .utils.helpers import utc_now_iso
 
 DB_PATH = Path(__file__).resolve().parent / "bot_memory.sqlite3"
 
@@ -41,10 +41,6 @@ SYSTEM_PROMPT_SUMMARY = """
 """.strip()
 
 
-def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
-
-
 def _open_db() -> sqlite3.Connection:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(DB_PATH, timeout=30)
@@ -113,7 +109,7 @@ def set_summary(chat_id: int, summary: str, last_message_id: int, mode: str = MO
               last_message_id=excluded.last_message_id,
               updated_at=excluded.updated_at
             """,
-            (int(chat_id), str(mode), (summary or "").strip(), int(last_message_id), _utc_now_iso()),
+            (int(chat_id), str(mode), (summary or "").strip(), int(last_message_id), utc_now_iso()),
         )
         conn.commit()
 
@@ -5,7 +5,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from .config import OPENROUTER_API_KEY
-from .openrouter import chat_completion_raw
+from .openrouter import chat_completion_raw, HTTP_SESSION
 
 TOKENS_TEST_KEY = "tokens_test_state"
 
@@ -57,7 +57,7 @@ def _chat_completion_raw_overlimit(
         "transforms": [],  # КЛЮЧ: отключаем transforms
     }
 
-    r = requests.post(OPENROUTER_CHAT_URL, headers=_headers(), json=payload, timeout=timeout)
+    r = HTTP_SESSION.post(OPENROUTER_CHAT_URL, headers=_headers(), json=payload, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
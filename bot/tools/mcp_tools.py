@@ -3,11 +3,9 @@
 from typing import Any
 from .base import Tool, ToolResult
 from ..core.context import AgentContext
-from ..mcp_client import (
-    get_git_branch,
-    get_weather_via_mcp,
-    get_news_via_mcp,
-)
+from ..mcp_client import get_git_branch
+from ..mcp_weather import get_weather_via_mcp
+from ..mcp_news import get_news_via_mcp
 
 
 class GitBranchTool(Tool):
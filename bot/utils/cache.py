@@ -0,0 +1,82 @@
+"""In-memory TTL caches, request coalescing and per-key locks shared by the bot and mcp_client."""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable
+
+
+def cache_get(cache: OrderedDict, key: Any, ttl: float, stats: dict | None = None) -> Any:
+    """
+    Return the cached value if it is younger than ttl seconds, else None.
+    Entries are (stored_at, value); a hit moves the key to the LRU end.
+    stats, if given, gets its "hits"/"misses" counters incremented.
+    """
+    entry = cache.get(key)
+    if entry is None or time.monotonic() - entry[0] >= ttl:
+        if entry is not None:
+            cache.pop(key, None)
+        if stats is not None:
+            stats["misses"] += 1
+        return None
+    cache.move_to_end(key)
+    if stats is not None:
+        stats["hits"] += 1
+    return entry[1]
+
+
+def cache_put(cache: OrderedDict, key: Any, value: Any, maxsize: int) -> None:
+    """Store value under key and evict the least recently used entries beyond maxsize."""
+    cache[key] = (time.monotonic(), value)
+    cache.move_to_end(key)
+    while len(cache) > maxsize:
+        cache.popitem(last=False)
+
+
+async def single_flight(inflight: dict, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run factory() once per key for all concurrent callers; inflight is the caller's registry of running tasks.
+    Cancelling one waiter does not cancel the shared task for the others.
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        inflight[key] = task
+
+        def forget(t: asyncio.Task) -> None:
+            if inflight.get(key) is t:
+                del inflight[key]
+            # retrieve the exception even if every waiter was cancelled, so it is not logged as never retrieved
+            if not t.cancelled():
+                t.exception()
+
+        task.add_done_callback(forget)
+    return await asyncio.shield(task)
+
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key. An entry lives only while someone holds or waits for it,
+    so the map does not grow with the number of keys ever seen.
+    """
+
+    def __init__(self) -> None:
+        self._locks: dict[Hashable, list] = {}  # key -> [lock, holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._locks)
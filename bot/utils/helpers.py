@@ -1,8 +1,22 @@
 """Helper functions."""
 
+import time
+
 from telegram.ext import ContextTypes
 
 
+_ts_cache: tuple[int, str] = (0, "")
+
+
+def utc_now_iso() -> str:
+    """Get current UTC time as ISO string (cached within the same second)."""
+    global _ts_cache
+    t = int(time.time())
+    if _ts_cache[0] != t:
+        _ts_cache = (t, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t)))
+    return _ts_cache[1]
+
+
 def reset_tz(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Reset TZ mode state."""
     context.user_data.pop("tz_history", None)
@@ -18,6 +32,10 @@ def reset_forest(context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data.pop("forest_result", None)
 
 
+_CITY_ENDING_MAP = {"а": "е", "о": "е", "ь": "и"}
+_CITY_VOWELS = frozenset("аеёиоуыэюяь")
+
+
 def _city_prepositional_case(city: str) -> str:
     """
     Склоняет название города в предложный падеж (где? в чём?).
@@ -27,19 +45,12 @@ def _city_prepositional_case(city: str) -> str:
     if not city:
         return city
     
-    city_lower = city.lower()
-    
-    if city_lower.endswith("а"):
-        return city[:-1] + "е"
-    
-    if city_lower.endswith("о"):
-        return city[:-1] + "е"
-    
-    if city_lower.endswith("ь"):
-        return city[:-1] + "и"
+    last_char = city[-1].lower()
+    ending = _CITY_ENDING_MAP.get(last_char)
+    if ending:
+        return city[:-1] + ending
     
-    last_char = city_lower[-1]
-    if last_char not in "аеёиоуыэюяь":
+    if last_char not in _CITY_VOWELS:
         return city + "е"
     
     return city
@@ -21,29 +21,42 @@ def split_telegram_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[
     if len(t) <= limit:
         return [t]
 
+    # Walk indices over the original string instead of re-slicing the tail each time
     parts: list[str] = []
-    cur = t
-    while len(cur) > limit:
-        cut = cur.rfind("\n", 0, limit)
-        if cut < 200:
-            cut = limit
-        parts.append(cur[:cut].rstrip())
-        cur = cur[cut:].lstrip()
-    if cur:
-        parts.append(cur)
+    start, n = 0, len(t)
+    while n - start > limit:
+        cut = t.rfind("\n", start, start + limit)
+        if cut - start < 200:
+            cut = start + limit
+        parts.append(t[start:cut].rstrip())
+        start = cut
+        while start < n and t[start].isspace():
+            start += 1
+    if start < n:
+        parts.append(t[start:])
     return parts
 
 
+def _first_non_space(text: str) -> int:
+    """Return index of the first non-whitespace character (len(text) if none), without copying."""
+    i, n = 0, len(text)
+    while i < n and text[i].isspace():
+        i += 1
+    return i
+
+
 def looks_like_json(text: str) -> bool:
     """Check if text looks like JSON."""
-    t = (text or "").lstrip()
-    return (t.startswith("{") and t.endswith("}")) or t.startswith("{")
+    t = text or ""
+    i = _first_non_space(t)
+    return i < len(t) and t[i] == "{"
 
 
 def is_forest_final(text: str) -> bool:
     """Check if text starts with FINAL marker."""
-    t = (text or "").lstrip()
-    return t.upper().startswith("FINAL")
+    t = text or ""
+    i = _first_non_space(t)
+    return t[i:i + 5].upper() == "FINAL"
 
 
 def strip_forest_final_marker(text: str) -> str:
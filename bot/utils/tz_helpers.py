@@ -8,7 +8,7 @@ from telegram.ext import ContextTypes
 from ..core.errors import safe_reply_text
 from ..core.prompts import SYSTEM_PROMPT_TZ
 from ..services.llm import call_llm
-from ..services.database import utc_now_iso
+from .helpers import utc_now_iso
 
 
 def extract_json_object(text: str) -> str:
@@ -108,8 +108,10 @@ async def weather_subscription_task(
                     # Парсим погоду и форматируем в нужный формат: "Москва, −2°C, ясно, ветер 6 м/с"
                     formatted_weather = _format_weather_for_summary(city, weather_text)
 
-                    # Записываем в БД
-                    db_add_message(chat_id, MODE_WEATHER_SUB, "assistant", f"{timestamp_str} — {formatted_weather}")
+                    # Записываем в БД (в потоке: SQLite-запись не должна останавливать event loop)
+                    await asyncio.to_thread(
+                        db_add_message, chat_id, MODE_WEATHER_SUB, "assistant", f"{timestamp_str} — {formatted_weather}"
+                    )
 
                     # Добавляем в список для summary
                     weather_records.append((timestamp_str, formatted_weather))